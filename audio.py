@@ -0,0 +1,402 @@
+### audio.py v0.1
+### A partial emulation of MicroPython micro:bit V2 audio library
+
+### Written for an Adafruit CLUE and CircuitPython 5.3.1, not yet tested on one
+
+### MIT License
+
+### Copyright (c) 2020 Kevin J. Walters
+
+### Permission is hereby granted, free of charge, to any person obtaining a copy
+### of this software and associated documentation files (the "Software"), to deal
+### in the Software without restriction, including without limitation the rights
+### to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+### copies of the Software, and to permit persons to whom the Software is
+### furnished to do so, subject to the following conditions:
+
+### The above copyright notice and this permission notice shall be included in all
+### copies or substantial portions of the Software.
+
+### THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+### IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+### FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+### AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+### LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+### OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+### SOFTWARE.
+
+import math
+import time
+from array import array
+
+import audiocore
+
+import microbit
+
+
+### Effects are rendered at this rate, it keeps the buffers small
+SAMPLE_RATE = 8000
+
+### Rendered effects are kept for reuse up to this many bytes,
+### least recently used are dropped first
+CACHE_BYTES = 32768
+_cache = {}
+_cache_order = []
+_cache_bytes = 0
+cache_hits = 0
+cache_misses = 0
+
+_TABLE_LEN = 256
+_MIDPOINT = 32768
+_MAX_VOLUME = 255
+
+### Speed and depth of the effects
+_TREMOLO_HZ = 8.0
+_TREMOLO_DEPTH = 0.5
+_VIBRATO_HZ = 6.0
+_VIBRATO_DEPTH = 0.03
+_WARBLE_HZ = 20.0
+_WARBLE_DEPTH = 0.1
+
+_POLL_MS = 5
+
+### AudioFrame streams are played through a ring of two halves
+### which are refilled alternately as the speaker loops over it
+STREAM_SAMPLE_RATE = 7812  ### the micro:bit uses 7812.5Hz
+STREAM_FRAMES_PER_HALF = 4
+STREAM_SERVICE_MS = 4
+underruns = 0
+_stream = None
+_SILENCE = 128
+_SEC_TO_NANO = 1000000000
+
+
+class SoundEffect:
+    """A sound effect made from a frequency sweep and volume envelope
+       of a waveform with optional vibrato, tremolo or warble.
+       The curve and log shapes are approximations of the micro:bit's.
+       """
+    WAVEFORM_SINE = 0
+    WAVEFORM_SAWTOOTH = 1
+    WAVEFORM_TRIANGLE = 2
+    WAVEFORM_SQUARE = 3
+    WAVEFORM_NOISE = 4
+
+    SHAPE_LINEAR = 1
+    SHAPE_CURVE = 2
+    SHAPE_LOG = 18
+
+    FX_NONE = 0
+    FX_VIBRATO = 1
+    FX_TREMOLO = 2
+    FX_WARBLE = 3
+
+    _WAVEFORM_NAMES = {WAVEFORM_SINE: "sine",
+                       WAVEFORM_SAWTOOTH: "sawtooth",
+                       WAVEFORM_TRIANGLE: "triangle",
+                       WAVEFORM_SQUARE: "square",
+                       WAVEFORM_NOISE: "noise"}
+
+    def __init__(self, freq_start=500, freq_end=2500, duration=500,
+                 vol_start=255, vol_end=0,
+                 waveform=WAVEFORM_SQUARE, fx=FX_NONE, shape=SHAPE_LOG):
+        self.freq_start = freq_start
+        self.freq_end = freq_end
+        self.duration = duration
+        self.vol_start = vol_start
+        self.vol_end = vol_end
+        self.waveform = waveform
+        self.fx = fx
+        self.shape = shape
+
+
+    def copy(self):
+        return SoundEffect(self.freq_start, self.freq_end, self.duration,
+                           self.vol_start, self.vol_end,
+                           self.waveform, self.fx, self.shape)
+
+
+    def _key(self):
+        return (self.freq_start, self.freq_end, self.duration,
+                self.vol_start, self.vol_end,
+                self.waveform, self.fx, self.shape)
+
+
+    def _frequency(self, pos):
+        """Frequency at pos from 0.0 to 1.0 through the effect."""
+        if self.shape == self.SHAPE_LOG and self.freq_start > 0 and self.freq_end > 0:
+            return self.freq_start * (self.freq_end / self.freq_start) ** pos
+        if self.shape == self.SHAPE_CURVE:
+            pos = pos * pos
+        return self.freq_start + (self.freq_end - self.freq_start) * pos
+
+
+    def render(self):
+        """Render the effect into an array of unsigned 16 bit samples."""
+        try:
+            waveform_name = self._WAVEFORM_NAMES[self.waveform]
+        except KeyError:
+            raise ValueError("invalid waveform")
+        table = microbit.ClueSpeaker._table(waveform_name, _TABLE_LEN)  ### pylint: disable=protected-access
+
+        frames = max(1, round(self.duration * SAMPLE_RATE / 1000))
+        buffer = array("H", [_MIDPOINT] * frames)
+        phase = 0.0
+        for idx in range(frames):
+            pos = idx / frames
+            secs = idx / SAMPLE_RATE
+            freq = self._frequency(pos)
+            volume = (self.vol_start + (self.vol_end - self.vol_start) * pos) / _MAX_VOLUME
+
+            if self.fx == self.FX_VIBRATO:
+                freq *= 1.0 + _VIBRATO_DEPTH * math.sin(2 * math.pi * _VIBRATO_HZ * secs)
+            elif self.fx == self.FX_WARBLE:
+                freq *= 1.0 + _WARBLE_DEPTH * math.sin(2 * math.pi * _WARBLE_HZ * secs)
+            elif self.fx == self.FX_TREMOLO:
+                volume *= 1.0 - _TREMOLO_DEPTH * (0.5 + 0.5 * math.sin(2 * math.pi
+                                                                      * _TREMOLO_HZ * secs))
+
+            buffer[idx] = round(_MIDPOINT + (table[int(phase) % _TABLE_LEN] - _MIDPOINT)
+                                * volume)
+            phase += freq * _TABLE_LEN / SAMPLE_RATE
+        return buffer
+
+
+class AudioFrame:
+    """32 unsigned 8 bit samples, 128 is silence."""
+    LENGTH = 32
+
+    def __init__(self):
+        self.data = bytearray(self.LENGTH)
+
+
+    def __len__(self):
+        return self.LENGTH
+
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+
+    def __setitem__(self, idx, value):
+        self.data[idx] = value
+
+
+    def copyfrom(self, other):
+        self.data[:] = other.data
+
+
+class _FrameStream:
+    """Plays AudioFrames from an iterator without allocating per frame.
+       The speaker loops over a ring buffer of two halves and the half
+       which is not playing is refilled, the position is worked out
+       from the time as the speaker cannot report it.
+       """
+
+    def __init__(self, frames):
+        self._frames = frames
+        frame_len = AudioFrame.LENGTH
+        self._half_len = STREAM_FRAMES_PER_HALF * frame_len
+        self._ring = bytearray([_SILENCE] * (2 * self._half_len))
+        ring_mv = memoryview(self._ring)
+        self._slots = [ring_mv[idx * frame_len:(idx + 1) * frame_len]
+                       for idx in range(2 * STREAM_FRAMES_PER_HALF)]
+        self._half_ns = self._half_len * _SEC_TO_NANO // STREAM_SAMPLE_RATE
+
+        self.underruns = 0
+        self.playing = True
+        self._end_half = None  ### set when the iterator finishes
+        self._filled = 0  ### count of halves filled so far
+        self._fill()
+        self._fill()
+        self._start_ns = time.monotonic_ns()
+        microbit.speaker.play_sample(audiocore.RawSample(self._ring,
+                                                         sample_rate=STREAM_SAMPLE_RATE),
+                                     loop=True)
+
+
+    def _fill(self):
+        first_slot = (self._filled % 2) * STREAM_FRAMES_PER_HALF
+        for slot_idx in range(first_slot, first_slot + STREAM_FRAMES_PER_HALF):
+            slot = self._slots[slot_idx]
+            frame = None
+            if self._end_half is None:
+                try:
+                    frame = next(self._frames)
+                except StopIteration:
+                    self._end_half = self._filled + 1
+            if frame is None:
+                for idx in range(AudioFrame.LENGTH):
+                    slot[idx] = _SILENCE
+            else:
+                slot[:] = frame.data
+        self._filled += 1
+
+
+    def service(self):
+        """Refill the half which is not playing, returns False when finished."""
+        global underruns  ### pylint: disable=global-statement
+
+        if not self.playing:
+            return False
+        playing_half = (time.monotonic_ns() - self._start_ns) // self._half_ns
+        if self._end_half is not None and playing_half >= self._end_half:
+            self.stop()
+            return False
+
+        ### The half playing now should have been filled before it started
+        if playing_half >= self._filled:
+            missed = playing_half - self._filled + 1
+            self.underruns += missed
+            underruns += missed
+            self._filled = playing_half + 1
+        while self._filled < playing_half + 2:
+            self._fill()
+        return True
+
+
+    def stop(self):
+        self.playing = False
+        microbit.speaker.music_off()
+
+
+def _serviceStream():
+    global _stream  ### pylint: disable=global-statement
+
+    if _stream is not None and not _stream.service():
+        microbit.scheduler.removeTask(_serviceStream)
+        _stream = None
+
+
+def _stopStream():
+    global _stream  ### pylint: disable=global-statement
+
+    if _stream is not None:
+        _stream.stop()
+        microbit.scheduler.removeTask(_serviceStream)
+        _stream = None
+
+
+def _playFrames(frames, wait):
+    global _stream  ### pylint: disable=global-statement
+
+    _stopStream()
+    _stream = _FrameStream(frames)
+    microbit.scheduler.addTask(_serviceStream, STREAM_SERVICE_MS)
+    if wait:
+        while _stream is not None:
+            microbit.scheduler.sleep(STREAM_SERVICE_MS)
+
+
+def _rendered(effect):
+    """The RawSample and buffer for effect from the cache or freshly rendered."""
+    global _cache_bytes, cache_hits, cache_misses  ### pylint: disable=global-statement
+
+    key = effect._key()  ### pylint: disable=protected-access
+    try:
+        entry = _cache[key]
+        _cache_order.remove(key)
+        _cache_order.append(key)
+        cache_hits += 1
+        return entry[0], entry[1]
+    except KeyError:
+        pass
+
+    cache_misses += 1
+    buffer = effect.render()
+    sample = audiocore.RawSample(buffer, sample_rate=SAMPLE_RATE)
+    size = len(buffer) * 2
+    if size <= CACHE_BYTES:
+        while _cache_bytes + size > CACHE_BYTES:
+            old_key = _cache_order.pop(0)
+            _cache_bytes -= _cache.pop(old_key)[2]
+        _cache[key] = (sample, buffer, size)
+        _cache_order.append(key)
+        _cache_bytes += size
+    return sample, buffer
+
+
+def _sample(effect):
+    return _rendered(effect)[0]
+
+
+def play(source, wait=True, pin=None, return_pin=None):
+    """Play a SoundEffect, a sequence of them or an iterable of AudioFrame
+       through the CLUE's speaker. A sequence of effects with wait False
+       is rendered before this returns and streamed like AudioFrames."""
+    if pin is not None and pin is not microbit.speaker:
+        raise NotImplementedError("audio only plays through speaker")
+    if return_pin is not None:
+        raise NotImplementedError("return_pin not supported")
+
+    _stopStream()
+    if isinstance(source, SoundEffect):
+        effects = (source,)
+    elif isinstance(source, AudioFrame):
+        _playFrames(iter((source,)), wait)
+        return
+    else:
+        ### Look at the first item to see if this is a stream of AudioFrame
+        items = iter(source)
+        try:
+            first = next(items)
+        except StopIteration:
+            return
+        if isinstance(first, AudioFrame):
+            _playFrames(_chain(first, items), wait)
+            return
+        effects = (first,) + tuple(items)
+
+    for effect in effects:
+        if not isinstance(effect, SoundEffect):
+            raise TypeError("source must be SoundEffect")
+
+    if not wait and len(effects) > 1:
+        ### Rendered now so the stream does not underrun between effects
+        _playFrames(_effectFrames([_rendered(effect)[1] for effect in effects]), False)
+        return
+
+    for effect in effects:
+        microbit.speaker.play_sample(_sample(effect))
+        if wait:
+            while microbit.speaker.playing:
+                microbit.scheduler.sleep(_POLL_MS)
+
+
+def _effectFrames(buffers):
+    """Yields AudioFrames of the rendered effects back to back
+       at the stream's sample rate, the same AudioFrame is reused."""
+    frame = AudioFrame()
+    data = frame.data
+    step = SAMPLE_RATE / STREAM_SAMPLE_RATE
+    idx = 0
+    for buffer in buffers:
+        pos = 0.0
+        length = len(buffer)
+        while pos < length:
+            data[idx] = buffer[int(pos)] >> 8
+            pos += step
+            idx += 1
+            if idx == AudioFrame.LENGTH:
+                yield frame
+                idx = 0
+    if idx:
+        for fill_idx in range(idx, AudioFrame.LENGTH):
+            data[fill_idx] = _SILENCE
+        yield frame
+
+
+def _chain(first, rest):
+    yield first
+    for item in rest:
+        yield item
+
+
+def is_playing():
+    return _stream is not None or microbit.speaker.playing
+
+
+def stop():
+    _stopStream()
+    if microbit.speaker.playing:
+        microbit.speaker.music_off()
@@ -0,0 +1,38 @@
+# Scrolling text while playing music and watching the buttons with asyncio
+# This needs CircuitPython 7.0.0 or later and the asyncio library
+
+import asyncio
+
+from microbit import *
+import music
+import microbit_async
+
+
+async def scroller():
+    while True:
+        await microbit_async.scroll_async("async on CLUE", delay=80)
+
+
+async def tune_player():
+    while True:
+        await microbit_async.play_async(music.ODE, speaker)
+        await microbit_async.sleep_async(1000)
+
+
+async def buttons():
+    while not button_b.was_pressed():
+        if button_a.was_pressed():
+            await microbit_async.pitch_async(880, 100, speaker)
+        await microbit_async.sleep_async(20)
+
+
+async def main():
+    tasks = [asyncio.create_task(scroller()), asyncio.create_task(tune_player())]
+    await buttons()
+    # Cancelling the music task stops its tune
+    for task in tasks:
+        task.cancel()
+    display.clear()
+
+
+asyncio.run(main())
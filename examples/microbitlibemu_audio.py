@@ -0,0 +1,40 @@
+# Sound effects and AudioFrame streams through the CLUE's speaker with audio
+
+from microbit import *
+import audio
+
+SoundEffect = audio.SoundEffect
+
+zap = SoundEffect(freq_start=2000, freq_end=200, duration=300,
+                  waveform=SoundEffect.WAVEFORM_SAWTOOTH,
+                  shape=SoundEffect.SHAPE_LOG)
+wobble = SoundEffect(freq_start=400, freq_end=400, duration=800,
+                     vol_start=200, vol_end=50,
+                     waveform=SoundEffect.WAVEFORM_SINE,
+                     fx=SoundEffect.FX_VIBRATO)
+
+# One effect waiting for it to finish then several in a row
+audio.play(zap)
+sleep(500)
+audio.play([zap, wobble, zap])
+
+# With wait=False the effects play while the program carries on
+audio.play([wobble, zap], wait=False)
+while audio.is_playing():
+    display.show(Image.MUSIC_QUAVER)
+    sleep(100)
+display.clear()
+
+
+# An iterable of AudioFrame is streamed, this one is a rising square wave
+def square_frames(count):
+    frame = audio.AudioFrame()
+    half_period = 16
+    for _ in range(count):
+        for idx in range(len(frame)):
+            frame[idx] = 200 if (idx // half_period) % 2 else 56
+        yield frame
+        half_period = max(1, half_period - 1)
+
+
+audio.play(square_frames(200))
@@ -0,0 +1,25 @@
+# Playing more than one tune at the same time with music.play_parts()
+
+from microbit import *
+import music
+
+# Each part needs its own pin, here the tune is on the CLUE's speaker
+# and the bass line is on pad 0 for a piezo buzzer
+melody = "e4:4 d c d e e e:8 d:4 d d:8 e:4 g g:8"
+bass = "c3:8 g2 c3 g2 c3 g2 c3:16"
+
+music.set_tempo(bpm=120)
+display.show(Image.MUSIC_QUAVERS)
+music.play_parts(((melody, speaker), (bass, pin0)))
+
+# A tune can be compiled once, the octave and duration do not carry on
+# from whatever was played before when it is played again
+bass_tune = music.compile_tune(bass, octave=3, duration=8)
+
+# wait=False plays in the background while the program carries on
+music.play_parts(((melody, speaker), (bass_tune, pin0)), wait=False, loop=True)
+while not button_a.was_pressed():
+    display.scroll("A to stop", delay=100)
+music.stop(speaker)
+music.stop(pin0)
+display.clear()
@@ -28,7 +28,9 @@
 
 
 import array
+import struct
 import time
+import os
 import math
 import collections
 
@@ -72,6 +74,12 @@ try:
 except ImportError:
     print("No light sensor library: adafruit_apds9960")
 
+### For storing compass calibration, CompassCalibration uses a file without it
+try:
+    import microcontroller
+except ImportError:
+    microcontroller = None
+
 
 ### For MicroBitDisplayViewEnhanced
 try:
@@ -93,63 +101,218 @@ MAX_BRIGHTNESS = 9
 ### Conversion factors
 _MICRO_TO_NANO = 1000
 _MILLI_TO_MICRO = 1000
+_MILLI_TO_NANO = 1000000
+_SEC_TO_NANO = 1000000000
 
 
-def _makeSample(length):
+def _makeWave(waveform, length):
+    """Generate one cycle of waveform as unsigned 16 bit values."""
     vol = 2 ** 15 - 1
     midpoint = 2 ** 15
+    noise = 0x2545F491  ### xorshift32 seed, this keeps noise tables repeatable
     for s_idx in range(length):
-        yield round(vol * math.sin(2 * math.pi * (s_idx / length)) + midpoint)
+        phase = s_idx / length
+        if waveform == "sine":
+            value = math.sin(2 * math.pi * phase)
+        elif waveform == "square":
+            value = 1.0 if phase < 0.5 else -1.0
+        elif waveform == "triangle":
+            value = 4.0 * phase - 1.0 if phase < 0.5 else 3.0 - 4.0 * phase
+        elif waveform == "sawtooth":
+            value = 2.0 * phase - 1.0
+        else:
+            noise ^= (noise << 13) & 0xffffffff
+            noise ^= noise >> 17
+            noise ^= (noise << 5) & 0xffffffff
+            value = noise / 0x7fffffff - 1.0
+        yield round(vol * value + midpoint)
+
+
+### MIDI note number to frequency lookup shared by music and
+### anything else producing notes, entry 0 is used as a rest
+class NoteFrequencies:
+    TEMPERAMENTS = ("equal", "just", "pythagorean")
+    MIDI_A4 = 69
+    MIDI_C4 = 60
+    REST = 0
+
+    ### Ratios for each semitone above the key note
+    _RATIOS = {"just": (1.0, 16 / 15, 9 / 8, 6 / 5, 5 / 4, 4 / 3,
+                        45 / 32, 3 / 2, 8 / 5, 5 / 3, 9 / 5, 15 / 8),
+               "pythagorean": (1.0, 256 / 243, 9 / 8, 32 / 27, 81 / 64, 4 / 3,
+                               729 / 512, 3 / 2, 128 / 81, 27 / 16, 16 / 9, 243 / 128)}
+
+    def __init__(self, reference=440.0, temperament="equal", key=0):
+        self.table = array.array("f", [0.0] * 128)
+        self.configure(reference=reference, temperament=temperament, key=key)
+
+
+    def configure(self, reference=440.0, temperament="equal", key=0):
+        """Recalculate the table for A4 at reference Hz, the temperaments
+           other than equal are tuned to the key with 0 for C to 11 for B.
+           """
+        if temperament not in self.TEMPERAMENTS:
+            raise ValueError("temperament must be one of " + str(self.TEMPERAMENTS))
+        if not 0 <= key <= 11:
+            raise ValueError("key must be 0 to 11")
+
+        table = self.table
+        ### 12 semitones in an octave
+        for midi_note in range(len(table)):
+            table[midi_note] = reference * 2 ** ((midi_note - self.MIDI_A4) / 12.0)
+
+        if temperament != "equal":
+            ratios = self._RATIOS[temperament]
+            tonic_midi = self.MIDI_C4 + key
+            tonic_freq = table[tonic_midi]
+            for midi_note in range(len(table)):
+                octave, degree = divmod(midi_note - tonic_midi, 12)
+                table[midi_note] = tonic_freq * ratios[degree] * 2.0 ** octave
+
+        table[self.REST] = 0.0
+        self.reference = reference
+        self.temperament = temperament
+        self.key = key
+
+
+    def __getitem__(self, midi_note):
+        return self.table[midi_note]
 
 
 class ClueSpeaker:
     """This allow the CLUE's tiny onboard speaker to be used as the
-       pin target for music.play(). """
+       pin target for music.play().
+       Notes are played from a cached wavetable for the waveform with the
+       table length picked per frequency band to keep the sample rate high.
+       Each note change stops and restarts the output.
+       """
 
-    _CLUE_LOW_FREQ = 40.0
+    WAVEFORMS = ("sine", "square", "triangle", "sawtooth", "noise")
+    MIN_FREQ = 10.0
+    _MAX_SAMPLE_RATE = 64000
+    _TABLE_LENGTHS = (8, 16, 32, 64, 128, 256, 512, 1024)
+    _tables = {}  ### (waveform, length) to array, shared by all instances
 
 
-    def __init__(self):
+    def __init__(self, waveform="sine"):
         self._audio = None
-        self._sample_len = 21
-        sine_wave = array.array("H", _makeSample(self._sample_len))
-        self._wave_sample = audiocore.RawSample(sine_wave)
+        self.waveform = waveform
+        self._samples = {}  ### (waveform, length) to a RawSample
+        self._frequency = 0
+        self.switch_stats = PulseStats()  ### note change latency in microseconds
+
+
+    @property
+    def waveform(self):
+        return self._waveform
+
+    @waveform.setter
+    def waveform(self, value):
+        if value not in self.WAVEFORMS:
+            raise ValueError("waveform must be one of " + str(self.WAVEFORMS))
+        self._waveform = value
+        self._frequency = None  ### next note must switch sample
+
+
+    @classmethod
+    def _table(cls, waveform, length):
+        key = (waveform, length)
+        try:
+            return cls._tables[key]
+        except KeyError:
+            table = array.array("H", _makeWave(waveform, length))
+            cls._tables[key] = table
+            return table
+
+
+    @classmethod
+    def _tableLength(cls, frequency):
+        """The longest table which keeps the sample rate within range."""
+        for length in reversed(cls._TABLE_LENGTHS):
+            if length * frequency <= cls._MAX_SAMPLE_RATE:
+                return length
+        return cls._TABLE_LENGTHS[0]
 
 
     def music_on(self):
         if self._audio is None:
+            ### PWMAudioOut keeps a PWM peripheral to itself
+            PWMManager.claim(self, None, variable=True)
             self._audio = audiopwmio.PWMAudioOut(board.SPEAKER)
 
 
     def music_off(self):
+        """Stop and free the PWMAudioOut and its PWM timer for pins."""
+        if self._audio is not None:
+            if self._audio.playing:
+                self._audio.stop()
+            self._audio.deinit()
+            self._audio = None
+            PWMManager.release(self)
+        self._frequency = 0
+
+
+    def _switch(self, sample, loop=True):
+        ### stop() needs to be called on a CLUE / PWMAudioOut
         if self._audio.playing:
             self._audio.stop()
+        self._audio.play(sample, loop=loop)
+
+
+    def _sample(self, length, sample_rate):
+        """The RawSample for the table set to sample_rate, the new rate
+           is used when _switch() restarts the output with it."""
+        key = (self._waveform, length)
+        try:
+            sample = self._samples[key]
+        except KeyError:
+            sample = audiocore.RawSample(self._table(self._waveform, length))
+            self._samples[key] = sample
+        sample.sample_rate = sample_rate
+        return sample
 
-        ##self._audio.deinit()
-        ##self._audio = None
+
+    def play_sample(self, sample, loop=False):
+        """Play a RawSample or other audiocore sample, this is used by audio."""
+        self.music_on()
+        self._frequency = None  ### next note must switch sample
+        self._switch(sample, loop=loop)
+
+
+    @property
+    def playing(self):
+        return self._audio is not None and self._audio.playing
 
 
     def music_frequency(self, frequency,
                         desc=None,  ### pylint: disable=unused-argument
                         ):
-        ### stop() needs to be called on a CLUE / PWMAudioOut
-        if self._audio.playing:
-            self._audio.stop()
+        ### The same frequency again is left playing undisturbed
+        if frequency == self._frequency and (frequency == 0 or self._audio.playing):
+            return
 
-        ### 0 turns off audio but also don't allow low frequencies
-        if frequency > self._CLUE_LOW_FREQ:
-            self._wave_sample.sample_rate = round(self._sample_len * frequency)
-            self._audio.play(self._wave_sample, loop=True)
+        start_ns = time.monotonic_ns()
+        ### 0 or very low frequencies turn off the audio
+        if frequency < self.MIN_FREQ:
+            if self._audio.playing:
+                self._audio.stop()
+        else:
+            length = self._tableLength(frequency)
+            self._switch(self._sample(length, round(length * frequency)))
+
+        self._frequency = frequency
+        self.switch_stats.add((time.monotonic_ns() - start_ns) // _MICRO_TO_NANO)
 
 
 def sleep(num_ms):
-    """Sleep for num_ms milliseconds."""
-    time.sleep(num_ms / 1000)
+    """Sleep for num_ms milliseconds running any background tasks,
+       an exception from a task, e.g. an irq handler, comes out of here."""
+    scheduler.sleep(num_ms)
 
 
 def running_time():
     """In milliseconds since power up."""
-    return time.monotonic_ns() // 1000000
+    return time.monotonic_ns() // _MILLI_TO_NANO
 
 
 def panic(error_code):
@@ -161,15 +324,79 @@ def reset():
     supervisor.reload()
 
 
+def update():
+    """Run any background tasks which are due, this can be called
+       by programs with busy loops which do not use sleep()."""
+    scheduler.run()
+
+
 ### Some class to manage the calls to update()
 ### for MicroBitButton and MicroBitDisplay
+### There are no threads so this runs tasks cooperatively when the library
+### is waiting in sleep() or the program calls update()
 class backGroundScheduler:
     def __init__(self):
-        raise NotImplementedError
+        self._tasks = []  ### Each is [func, period_ns, next_run_ns, running]
+
+
+    def addTask(self, func, period_ms):
+        self._tasks.append([func,
+                            round(period_ms * _MILLI_TO_NANO),
+                            time.monotonic_ns(),
+                            False])
+
+
+    def removeTask(self, func):
+        len_before_rm = len(self._tasks)
+        self._tasks = [t for t in self._tasks if t[0] is not func]
+        return len_before_rm - len(self._tasks)
 
 
     def run(self):
-        raise NotImplementedError
+        """Run the tasks which are due and return the time in nanoseconds
+           until the next one is due or None if there are no tasks.
+           A task which sleeps will not be run again until it returns
+           but the other tasks will be.
+           An exception from a task is not caught, it comes out of whichever
+           run(), sleep() or update() call ran the task. The task is still
+           scheduled and will next run after its period.
+           """
+        next_run_ns = None
+        now_ns = time.monotonic_ns()
+        for task in self._tasks:
+            if now_ns >= task[2] and not task[3]:
+                ### Move on the next run first so a task which raises
+                ### does not run again immediately
+                task[2] += task[1]
+                ### Skip any runs which have been missed
+                if task[2] <= now_ns:
+                    task[2] = now_ns + task[1]
+                task[3] = True
+                try:
+                    task[0]()
+                finally:
+                    task[3] = False
+            if not task[3] and (next_run_ns is None or task[2] < next_run_ns):
+                next_run_ns = task[2]
+
+        return None if next_run_ns is None else max(0, next_run_ns - now_ns)
+
+
+    def sleepUntil(self, deadline_ns):
+        """Sleep until time.monotonic_ns() reaches deadline_ns running
+           tasks as they become due, an exception from a task ends the sleep."""
+        while True:
+            wait_ns = self.run()
+            remaining_ns = deadline_ns - time.monotonic_ns()
+            if remaining_ns <= 0:
+                break
+            if wait_ns is None or wait_ns > remaining_ns:
+                wait_ns = remaining_ns
+            time.sleep(wait_ns / _SEC_TO_NANO)
+
+
+    def sleep(self, num_ms):
+        self.sleepUntil(time.monotonic_ns() + round(num_ms * _MILLI_TO_NANO))
 
 
 def _bytesToWidth(data, offset,
@@ -340,8 +567,140 @@ MicroBitFonts.STANDARD_WIDTHS = MicroBitFonts.PENDOLINO3_WIDTHS
 ### https://microbit-micropython.readthedocs.io/en/latest/microbit.html
 ###
 
+### Light level from the APDS9960 clear channel for read_light_level()
+### The colour engine converts all four channels together so the saving
+### here is in only reading the two clear bytes, not repeating the read
+### within one integration period and turning off the other engines
+class MicroBitLightSensor:
+    _ATIME = 0x81
+    _CONTROL = 0x8F
+    _CDATAL = 0x94
+
+    _CYCLE_MS = 2.78
+    _MAX_CYCLES = 256
+    _COUNTS_PER_CYCLE = 1025
+    _MAX_COUNT = 65535
+    GAINS = (1, 4, 16, 64)
+
+    def __init__(self, sensor, *, integration_time_ms=None, gain=None, smoothing=0.0):
+        """sensor is an adafruit_apds9960 APDS9960, integration_time_ms
+           and gain of None leave the sensor's current settings.
+           """
+        self._sensor = sensor
+        self._reg_buf = bytearray(2)
+        self._data_buf = bytearray(2)
+
+        sensor.enable_proximity = False
+        sensor.enable_gesture = False
+        sensor.enable_color = True
+
+        if integration_time_ms is not None:
+            self.integration_time_ms = integration_time_ms
+        else:
+            self._cycles = self._MAX_CYCLES - self._readReg(self._ATIME)
+        if gain is not None:
+            self.gain = gain
+        self.smoothing = smoothing
+
+        self._level = None
+        self._level_ns = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+    def _writeReg(self, reg, value):
+        self._reg_buf[0] = reg
+        self._reg_buf[1] = value
+        with self._sensor.i2c_device as i2c:
+            i2c.write(self._reg_buf)
+
+
+    def _readRegs(self, reg, length):
+        self._reg_buf[0] = reg
+        with self._sensor.i2c_device as i2c:
+            i2c.write_then_readinto(self._reg_buf, self._data_buf,
+                                    out_end=1, in_end=length)
+        return self._data_buf
+
+
+    def _readReg(self, reg):
+        return self._readRegs(reg, 1)[0]
+
+
+    @property
+    def integration_time_ms(self):
+        """Longer times are less noisy but readings change less often,
+           this is rounded to a multiple of 2.78ms up to 712ms."""
+        return self._cycles * self._CYCLE_MS
+
+    @integration_time_ms.setter
+    def integration_time_ms(self, value):
+        cycles = min(self._MAX_CYCLES, max(1, round(value / self._CYCLE_MS)))
+        self._writeReg(self._ATIME, self._MAX_CYCLES - cycles)
+        self._cycles = cycles
+        self._level = None  ### scale has changed
+
+
+    @property
+    def gain(self):
+        return self.GAINS[self._readReg(self._CONTROL) & 0x03]
+
+    @gain.setter
+    def gain(self, value):
+        try:
+            again = self.GAINS.index(value)
+        except ValueError:
+            raise ValueError("gain must be one of " + str(self.GAINS))
+        control = self._readReg(self._CONTROL)
+        self._writeReg(self._CONTROL, (control & ~0x03) | again)
+        self._level = None
+
+
+    @property
+    def smoothing(self):
+        """0.0 to less than 1.0, this applies a low pass filter to each new
+           conversion, higher values are smoother but respond more slowly."""
+        return self._smoothing
+
+    @smoothing.setter
+    def smoothing(self, value):
+        if not 0.0 <= value < 1.0:
+            raise ValueError("smoothing must be 0.0 to less than 1.0")
+        self._smoothing = value
+
+
+    def read_clear(self):
+        """The raw 16 bit clear channel count."""
+        data = self._readRegs(self._CDATAL, 2)
+        return data[0] | data[1] << 8
+
+
+    def read(self):
+        """Light level 0-255, this only reads the sensor once
+           per integration period."""
+        now_ns = time.monotonic_ns()
+        if (self._level is not None
+                and now_ns - self._level_ns < self._cycles * self._CYCLE_MS * _MILLI_TO_NANO):
+            self.cache_hits += 1
+            return round(self._level)
+
+        self.cache_misses += 1
+        ### Scale by the maximum count so the level does not depend
+        ### on the integration time
+        full_scale = min(self._MAX_COUNT, self._COUNTS_PER_CYCLE * self._cycles)
+        level = min(255, self.read_clear() * 255 / full_scale)
+        if self._level is None:
+            self._level = level
+        else:
+            self._level += (1.0 - self._smoothing) * (level - self._level)
+        self._level_ns = now_ns
+        return round(self._level)
+
+
 ### This is the actual type of microbit.display
 class MicroBitDisplay():
+    _HUB_NAME = "light"
+
     def __init__(self, display=None,  ### pylint: disable=redefined-outer-name
                  mode="basic",
                  *,
@@ -367,9 +726,8 @@ class MicroBitDisplay():
         self._initView(display, mode,
                        led_rows=led_rows, led_cols=led_cols)
 
-        self._light_sensor = light_sensor
-        if light_sensor:
-            light_sensor.enable_color = True
+        self.light = MicroBitLightSensor(light_sensor) if light_sensor else None
+        self._hub = None
         self._showing = None
         self._scrolling = None
         self._led_rows = led_rows
@@ -448,6 +806,12 @@ class MicroBitDisplay():
         if not wait:
             raise NotImplementedError
 
+        for frame_delay in self._showFrames(value, delay, loop=loop, clear=clear):
+            scheduler.sleep(frame_delay)
+
+
+    def _showFrames(self, value, delay, *, loop, clear):
+        """Show each frame yielding the delay to wait after it."""
         self.view_update_count = 0
 
         ### value can be all sorts of things including an image
@@ -462,19 +826,19 @@ class MicroBitDisplay():
             self.showItem(show_seq[0], seq=show_seq)
             return  ### Impl. on microbit has no delay for "a" or 5
 
-        elem_delay_s = delay / 1000.0
         ### TODO _showing needs to have loop and delay in too
         self._showing = enumerate(show_seq)
         while True:
             try:
                 idx, elem = next(self._showing)
                 self.showItem(elem, seq=show_seq, seq_idx=idx)
-                time.sleep(elem_delay_s)
             except StopIteration:
                 if loop:
                     self._showing = enumerate(show_seq)
+                    continue
                 else:
                     break
+            yield delay
         self._showing = None
         if clear:
             self.clear()
@@ -527,6 +891,12 @@ class MicroBitDisplay():
         if not wait:
             raise NotImplementedError
 
+        for frame_delay in self._scrollFrames(value, delay, loop=loop, monospace=monospace):
+            scheduler.sleep(frame_delay)
+
+
+    def _scrollFrames(self, value, delay, *, loop, monospace):
+        """Scroll one column at a time yielding the delay to wait after each."""
         ### Clear screen
         self.clear()
         self.view_update_count = 0  ### This must be zeroed after clear()
@@ -535,7 +905,7 @@ class MicroBitDisplay():
                   "char_col": 0,
                   "idx" : 0,
                   "loop": loop,
-                  "delay": delay / 1000.0}
+                  "delay": delay}
         self._scrolling = scroll
 
         text_len = len(scroll["text"])
@@ -568,7 +938,7 @@ class MicroBitDisplay():
             if scroll["char_col"] > width:
                 scroll["char_col"] = 0
                 scroll["idx"] += 1
-            time.sleep(scroll["delay"])
+            yield scroll["delay"]
 
         self._scrolling = None
 
@@ -645,15 +1015,27 @@ class MicroBitDisplay():
 
 
     ### Rather clever implementation on micro:bit although there is a visible flicker
-    def read_light_level(self):
-        """ TODO - this is 0-255, reads 30 on a micro:bit at my desk"""
-        if self._light_sensor:
-            ### r,g,b,clear comes back from the APDS9960
-            return self._light_sensor.color_data[3] // 256
+    def _busRead(self):
+        if self.light:
+            return self.light.read()
         else:
             raise RuntimeError("No light sensor configured - missing library?")
 
 
+    def _readLightLevel(self):
+        if self._hub is not None:
+            return self._hub.latest(self._HUB_NAME)
+        return self._busRead()
+
+
+    def read_light_level(self):
+        """ TODO - this is 0-255, reads 30 on a micro:bit at my desk"""
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input("display.read_light_level",
+                                                 self._readLightLevel)
+        return self._readLightLevel()
+
+
     @property
     def group(self):
         return self.view.group
@@ -1290,65 +1672,166 @@ del SYMBOL_BYTES, SYMBOL_NAMES
 
 
 class MicroBitButtonMonitor():
-    """A monitor for multiple buttons to enable queries for presses in the past.
-       All of the users of this class must create an instance of it
-       before was_pressed() is called.
+    """A monitor for a button which debounces it and records the press and
+       release edges with timestamps in a bounded event queue.
+       All the monitors are polled together by pollAll() which runs as a task
+       on the background scheduler, the gamepad module's latching
+       is used to catch presses which are shorter than the polling interval.
        """
 
-    _gamepad = None
-
-    buttons = 0
-    button_callback = {}
-    button_index = {}
-    button_digin = []
+    DEBOUNCE_MS = 20
+    LONG_PRESS_MS = 1000
+    DOUBLE_CLICK_MS = 400
+    POLL_MS = 10
+    QUEUE_LEN = 16
 
-    _pressed_unread = 0x00   ### tracks pressed buttons for was_pressed()
+    _gamepad = None
+    monitors = []
 
     def __init__(self, name, digin, call_back=None):
         self.name = name
+        self._digin = digin
+        self._call_back = call_back
         cls = type(self)
-        cls.button_digin.append(digin)
-        cls.button_callback[name] = call_back
-        cls.button_index[name] = cls.buttons
-        cls.buttons += 1
+        self._mask = 0x01 << len(cls.monitors)
+        cls.monitors.append(self)
+        if cls._gamepad is not None:
+            cls._gamepad_init()
+
+        self.pressed = False
+        self._candidate = None       ### state waiting for debounce to finish
+        self._candidate_ms = 0
+        self._quiet = True           ### released with no candidate at last poll
+        self._press_ms = 0
+        self._long_counted = False
+        self._last_click_ms = None
+
+        ### Running totals and the values they had at the last query
+        self.presses = 0
+        self.long_presses = 0
+        self.double_clicks = 0
+        self._presses_read = {"was_pressed": 0, "get_presses": 0,
+                              "was_long_pressed": 0, "was_double_clicked": 0}
+
+        ### Ring buffer of edges
+        self._ev_time = array.array("L", [0] * self.QUEUE_LEN)
+        self._ev_pressed = bytearray(self.QUEUE_LEN)
+        self._ev_next = 0
+        self._ev_count = 0
+        self.dropped = 0
 
 
     @classmethod
     def _gamepad_init(cls):
-        cls._gamepad = gamepad.GamePad(*cls.button_digin)
+        cls._gamepad = gamepad.GamePad(*[m._digin for m in cls.monitors])  ### pylint: disable=protected-access
 
 
     @classmethod
-    def _updatePressedUnread(cls, value):
-        cls._pressed_unread = value
+    def pollAll(cls):
+        """Sample all the buttons, this is run by the background scheduler."""
+        if cls._gamepad is None:
+            cls._gamepad_init()
+
+        latched = cls._gamepad.get_pressed()
+        now_ms = running_time()
+        for monitor in cls.monitors:
+            monitor.sample(not monitor._digin.value, now_ms,  ### pylint: disable=protected-access
+                           latched=bool(latched & monitor._mask))  ### pylint: disable=protected-access
+
+
+    def sample(self, raw_pressed, now_ms, *, latched=False):
+        """Debounce a sample of the button state recording any edges."""
+        if raw_pressed != self.pressed:
+            if self._candidate is None:
+                self._candidate = raw_pressed
+                self._candidate_ms = now_ms
+            elif now_ms - self._candidate_ms >= self.DEBOUNCE_MS:
+                self._edge(raw_pressed, self._candidate_ms)
+                self._candidate = None
+        else:
+            self._candidate = None
+
+        if latched and self._quiet and not raw_pressed and self._candidate is None:
+            ### A press came and went between polls
+            self._edge(True, now_ms)
+            self._edge(False, now_ms)
+
+        if (self.pressed and not self._long_counted
+                and now_ms - self._press_ms >= self.LONG_PRESS_MS):
+            self._long_counted = True
+            self.long_presses += 1
+
+        self._quiet = not self.pressed and self._candidate is None
+
+
+    def _edge(self, pressed, edge_ms):
+        self.pressed = pressed
+        if self._ev_count == self.QUEUE_LEN:
+            self.dropped += 1
+        else:
+            self._ev_count += 1
+        self._ev_time[self._ev_next] = edge_ms & 0xffffffff
+        self._ev_pressed[self._ev_next] = pressed
+        self._ev_next = (self._ev_next + 1) % self.QUEUE_LEN
+
+        if pressed:
+            self.presses += 1
+            self._press_ms = edge_ms
+            self._long_counted = False
+            if (self._last_click_ms is not None
+                    and edge_ms - self._last_click_ms <= self.DOUBLE_CLICK_MS):
+                self.double_clicks += 1
+                self._last_click_ms = None
+            else:
+                self._last_click_ms = edge_ms
+
+            if self._call_back is not None:
+                self._call_back(self.name, self._mask, pressed)
+
+        elif not self._long_counted and edge_ms - self._press_ms >= self.LONG_PRESS_MS:
+            self._long_counted = True
+            self.long_presses += 1
+
+
+    def _countSince(self, query, total):
+        """Return how much total has increased since the last query of this type."""
+        count = total - self._presses_read[query]
+        self._presses_read[query] = total
+        return count
 
 
     def was_pressed(self):
-        if self._gamepad is None:
-            self._gamepad_init()
+        scheduler.run()
+        return self._countSince("was_pressed", self.presses) > 0
 
-        all_pressed = self._gamepad.get_pressed()
-        combined_pressed = all_pressed | self._pressed_unread
 
-        ### Do callbacks for all buttons but only set pressed for
-        ### the button associated with this instance
-        button_idx = self.button_index.get(self.name)
-        pressed = False
-        mask = 0x01
-        for idx in range(self.buttons):
-            if combined_pressed & mask:
-                try:
-                    self.button_callback[self.name](self.name, mask, combined_pressed)
-                except (KeyError, TypeError):
-                    pass
-                if idx == button_idx:
-                    pressed = True
-            mask <<= 1
+    def get_presses(self):
+        scheduler.run()
+        return self._countSince("get_presses", self.presses)
+
+
+    def was_long_pressed(self):
+        scheduler.run()
+        return self._countSince("was_long_pressed", self.long_presses) > 0
 
-        ### Note the buttons pressed which are not this one
-        self._updatePressedUnread(combined_pressed & ~(0x01 << button_idx))
 
-        return pressed
+    def was_double_clicked(self):
+        scheduler.run()
+        return self._countSince("was_double_clicked", self.double_clicks) > 0
+
+
+    def get_events(self):
+        """Return and remove the queued edges as a list of
+           (time_ms, pressed) tuples, oldest first.
+           The times are running_time() values truncated to 32 bits."""
+        scheduler.run()
+        events = []
+        idx = (self._ev_next - self._ev_count) % self.QUEUE_LEN
+        for _ in range(self._ev_count):
+            events.append((self._ev_time[idx], bool(self._ev_pressed[idx])))
+            idx = (idx + 1) % self.QUEUE_LEN
+        self._ev_count = 0
+        return events
 
 
 ### For button_a (left) and button_b (right)
@@ -1361,24 +1844,85 @@ class MicroBitButton():
         pin_obj.set_pull(pin_obj.PULL_UP)
 
         button_name = str(pin_obj.pin).split(".")[-1] if name is None else name
+        self.name = button_name
 
         self._monitor = MicroBitButtonMonitor(button_name, pin_obj.get_diginout())
 
 
+    def _isPressed(self):
+        pressed = not bool(self._pin_obj.read_digital())
+        self._monitor.sample(pressed, running_time())
+        return self._monitor.pressed
+
+
+    def _stimulus(self, query, func):
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input(self.name + "." + query, func)
+        return func()
+
+
     def is_pressed(self):
         """Returns True if button is currently pressed, otherwise False.
+           This is the debounced state.
            """
-        pressed = self._pin_obj.read_digital()
-        return not bool(pressed)
+        return self._stimulus("is_pressed", self._isPressed)
 
 
     def was_pressed(self):
-        return self._monitor.was_pressed()
+        return self._stimulus("was_pressed", self._monitor.was_pressed)
+
 
-    ### This seems to be number of presses since last call to get_presses()
-    ### May not be possible
     def get_presses(self):
-        raise NotImplementedError
+        """Number of presses since the last call to get_presses()."""
+        return self._stimulus("get_presses", self._monitor.get_presses)
+
+
+    ### Extras
+
+    def was_long_pressed(self):
+        """True if a press of at least MicroBitButtonMonitor.LONG_PRESS_MS
+           has been made since the last call."""
+        return self._stimulus("was_long_pressed", self._monitor.was_long_pressed)
+
+
+    def was_double_clicked(self):
+        return self._stimulus("was_double_clicked", self._monitor.was_double_clicked)
+
+
+    def get_events(self):
+        return self._monitor.get_events()
+
+
+class PulseStats:
+    """Running statistics for pulse durations in microseconds,
+       also used for SensorHub read latencies."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
 
 
 ### https://microbit-micropython.readthedocs.io/en/latest/pin.html#classes
@@ -1420,6 +1964,20 @@ class MicroBitDigitalPin():
     PULL_DOWN = 1
     PULL_UP = 3
 
+    ### For irq() triggers, these can be or'ed together
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    IRQ_POLL_MS = 2
+
+    _irq_pins = []
+    _irq_tasks = ()
+
+    PULSE_DRAIN_MS = 10
+
+    _pulse_pins = []
+    _pulse_task = None
+
     def _nop(self):
         pass
 
@@ -1432,6 +1990,21 @@ class MicroBitDigitalPin():
         self._mode = "unused"
         self._deinit = self._nop  ### This is the method used to turn-off previous use
         self._post_hooks = {}
+        self._irq_handler = None
+        self._irq_trigger = 0
+        self._irq_value = 0
+        self._irq_pending = 0     ### edges waiting for the handler
+        self._irq_time_ns = 0     ### time of first pending edge
+        self.irq_edges = 0
+        self.irq_last_edges = 0   ### edges for the current handler call
+        self.irq_last_time_ns = 0
+        self.irq_delivered = 0
+        self.irq_coalesced = 0
+        self._pulsein = None      ### CircuitPython PulseIn
+        self._pulse_idle = None
+        self._pulse_parity = 0    ### 0 if next pulse is the active level
+        self.pulse_active = PulseStats()
+        self.pulse_idle = PulseStats()
 
 
     def addHook(self, method_name, when, cb, cb_args):
@@ -1449,7 +2022,10 @@ class MicroBitDigitalPin():
             callbacks = self._post_hooks.get(method_name)
             if callbacks is not None:
                 len_before_rm = len(callbacks)
-                self._post_hooks[method_name] = [c for c in callbacks if c[0] is not cb]
+                ### Match the args too so users sharing a callback
+                ### such as two PinTraceRecorder only remove their own
+                self._post_hooks[method_name] = [c for c in callbacks
+                                                 if c[0] is not cb or c[1] is not cb_args]
                 count = len_before_rm - len(self._post_hooks[method_name])
         return count
 
@@ -1470,6 +2046,8 @@ class MicroBitDigitalPin():
 
 
     def _digitalDeinit(self, mark_unused=False):
+        if self._irq_handler is not None:
+            self.irq(None)  ### an irq only works in read_digital mode
         if self._diginout:
             self._diginout.deinit()
             self._diginout = None
@@ -1534,11 +2112,19 @@ class MicroBitDigitalPin():
         raise ValueError("_pull illegal value: " + str(self._pull))
 
 
-    def read_digital(self):
+    def _readDigital(self):
         if self._mode != "read_digital":
             self._deinit()
             self._digital("in")
-        rv = 1 if self._diginout.value else 0
+        return 1 if self._diginout.value else 0
+
+
+    def read_digital(self):
+        if StimulusRecorder.active:
+            rv = StimulusRecorder.active.input(self.pin_name + ".read_digital",
+                                               self._readDigital)
+        else:
+            rv = self._readDigital()
         self._runHooks("read_digital", "post", rv)
         return rv
 
@@ -1561,6 +2147,191 @@ class MicroBitDigitalPin():
         return self._diginout
 
 
+    ### Extras
+
+    def irq(self, handler=None, trigger=IRQ_RISING | IRQ_FALLING):
+        """Call handler(pin) when the pin changes like MicroPython's Pin.irq,
+           the handler can read irq_last_edges with IRQ_RISING and/or
+           IRQ_FALLING set and irq_last_time_ns, the time of the
+           first edge. The pins are polled together every
+           IRQ_POLL_MS by the background scheduler and the handlers
+           are called from there too.
+           Any edges which occur before the handler has been called for
+           the previous ones are coalesced into one call and counted
+           in irq_coalesced. A handler of None removes the irq, it is also
+           removed if the pin is used for anything other than read_digital.
+           """
+        cls = MicroBitDigitalPin
+        if handler is None:
+            self._irq_handler = None
+            self._irq_pending = 0
+            if self in cls._irq_pins:
+                ### A new list as this may be called from a handler
+                cls._irq_pins = [pin for pin in cls._irq_pins if pin is not self]
+                if not cls._irq_pins:
+                    for task in cls._irq_tasks:
+                        scheduler.removeTask(task)
+            return
+
+        self._readDigital()  ### irq needs the pin to be an input
+        self._irq_handler = handler
+        self._irq_trigger = trigger
+        self._irq_value = 1 if self._diginout.value else 0
+        self._irq_pending = 0
+        if self not in cls._irq_pins:
+            if not cls._irq_pins:
+                ### Separate tasks so polling continues if a handler sleeps
+                cls._irq_tasks = (cls._pollIrqs, cls._dispatchIrqs)
+                for task in cls._irq_tasks:
+                    scheduler.addTask(task, cls.IRQ_POLL_MS)
+            cls._irq_pins.append(self)
+
+
+    @classmethod
+    def _pollIrqs(cls):
+        now_ns = time.monotonic_ns()
+        for pin in cls._irq_pins:
+            pin._irqSample(1 if pin._diginout.value else 0, now_ns)  ### pylint: disable=protected-access
+
+
+    def _irqSample(self, value, now_ns):
+        if value == self._irq_value:
+            return
+        self._irq_value = value
+        edge = self.IRQ_RISING if value else self.IRQ_FALLING
+        if edge & self._irq_trigger:
+            self.irq_edges += 1
+            if self._irq_pending:
+                self.irq_coalesced += 1
+            else:
+                self._irq_time_ns = now_ns
+            self._irq_pending |= edge
+
+
+    def _deinitPulseIn(self, mark_unused=False):
+        if self._pulsein:
+            self._pulsein.deinit()
+            self._pulsein = None
+            self._pulse_idle = None
+        if self in self._pulse_pins:
+            self._pulse_pins.remove(self)
+            if not self._pulse_pins:
+                scheduler.removeTask(MicroBitDigitalPin._pulse_task)
+
+        if mark_unused:
+            self._mode = "unused"
+            self._deinit = self._nop
+
+
+    def _pulseIn(self, idle_state, maxlen):
+        if (self._mode != "pulse_in"
+                or self._pulse_idle != idle_state
+                or self._pulsein.maxlen < maxlen):
+            self._deinit()
+            self._pulsein = pulseio.PulseIn(self.pin, maxlen=maxlen,
+                                            idle_state=bool(idle_state))
+            self._pulse_idle = idle_state
+            self._mode = "pulse_in"
+            self._deinit = self._deinitPulseIn
+        else:
+            self._pulsein.pause()
+        self._pulsein.clear()
+        self._pulsein.resume()
+
+
+    def _timePulseUs(self, level, timeout_us):
+        deadline_ns = time.monotonic_ns() + timeout_us * _MICRO_TO_NANO
+        ### Like MicroPython wait for the pin to leave level first so the rest
+        ### of a pulse already in progress is not timed, the first pulse
+        ### PulseIn records is then the next one at level
+        while self._readDigital() == level:
+            if time.monotonic_ns() >= deadline_ns:
+                return -1
+            scheduler.run()
+
+        self._pulseIn(0 if level else 1, 2)
+        pulses = self._pulsein
+        while len(pulses) == 0:
+            if time.monotonic_ns() >= deadline_ns:
+                return -1
+            scheduler.run()
+        return pulses[0]
+
+
+    def time_pulse_us(self, level, timeout_us=1000000):
+        """Return the duration in microseconds of the next pulse at level
+           (0 or 1) or -1 on timeout. If the pin is already at level this
+           waits for it to change first. This is measured by pulseio.PulseIn
+           which has a maximum of 65535us.
+           """
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input(self.pin_name + ".time_pulse_us",
+                                                 lambda: self._timePulseUs(level, timeout_us))
+        return self._timePulseUs(level, timeout_us)
+
+
+    def start_pulse_counting(self, idle_state=0, maxlen=64):
+        """Continuously measure the pulses on the pin in the background,
+           the statistics accumulate in pulse_active and pulse_idle.
+           maxlen must be large enough to hold the pulses arriving
+           in PULSE_DRAIN_MS.
+           """
+        self._pulseIn(idle_state, maxlen)
+        self._pulse_parity = 0
+        self.pulse_active.reset()
+        self.pulse_idle.reset()
+        if self not in self._pulse_pins:
+            if not self._pulse_pins:
+                MicroBitDigitalPin._pulse_task = MicroBitDigitalPin._drainAllPulses
+                scheduler.addTask(MicroBitDigitalPin._pulse_task, self.PULSE_DRAIN_MS)
+            self._pulse_pins.append(self)
+
+
+    def stop_pulse_counting(self):
+        if self._mode == "pulse_in":
+            self._deinit(mark_unused=True)
+
+
+    def _drainPulses(self):
+        pulses = self._pulsein
+        if pulses is None:
+            return
+        for _ in range(len(pulses)):
+            duration = pulses.popleft()
+            if self._pulse_parity:
+                self.pulse_idle.add(duration)
+            else:
+                self.pulse_active.add(duration)
+            self._pulse_parity ^= 1
+
+
+    @classmethod
+    def _drainAllPulses(cls):
+        for pin in cls._pulse_pins:
+            pin._drainPulses()  ### pylint: disable=protected-access
+
+
+    def get_frequency(self):
+        """The mean frequency in Hz of the pulses measured since
+           start_pulse_counting() or 0 if there are not enough yet."""
+        self._drainPulses()
+        if self.pulse_active.count == 0 or self.pulse_idle.count == 0:
+            return 0
+        return 1e6 / (self.pulse_active.mean + self.pulse_idle.mean)
+
+
+    @classmethod
+    def _dispatchIrqs(cls):
+        for pin in cls._irq_pins:
+            edges = pin._irq_pending  ### pylint: disable=protected-access
+            if edges:
+                pin._irq_pending = 0  ### pylint: disable=protected-access
+                pin.irq_delivered += 1
+                pin.irq_last_edges = edges
+                pin.irq_last_time_ns = pin._irq_time_ns  ### pylint: disable=protected-access
+                pin._irq_handler(pin)  ### pylint: disable=protected-access
+
+
 ### pin10, pin3, pin4
 class MicroBitAnalogDigitalPin(MicroBitDigitalPin):
     DEFAULT_FREQUENCY = 50
@@ -1571,15 +2342,41 @@ class MicroBitAnalogDigitalPin(MicroBitDigitalPin):
 
     def __init__(self, pin):      ## , direction="in")
         super().__init__(pin)     ## , direction="in", mode="digital")
-        self._pwm = None  ### needs to be variable frequency
+        self._pwm = None
+        self._pwm_variable = False
         self._analogin = None
         self._frequency = self.DEFAULT_FREQUENCY  ## Looks like 20ms period on my iffy scope
 
 
-    def _deinitAnalog(self, mark_unused=False):
+    def _deinitPWM(self):
         if self._pwm:
             self._pwm.deinit()
             self._pwm = None
+            PWMManager.release(self)
+
+
+    def _initPWM(self, variable):
+        if self._pwm and self._pwm_variable != variable:
+            self._deinitPWM()
+        if self._pwm is None:
+            ### Only music needs variable frequency, fixed frequency
+            ### PWM can share a timer with other pins at the same period
+            frequency = self.DEFAULT_FREQUENCY if variable else self._frequency
+            PWMManager.claim(self, frequency, variable=variable)
+            try:
+                self._pwm = pulseio.PWMOut(self.pin,
+                                           frequency=frequency,
+                                           duty_cycle=0,
+                                           variable_frequency=variable)
+            except (RuntimeError, ValueError):
+                PWMManager.failures += 1
+                PWMManager.release(self)
+                raise
+            self._pwm_variable = variable
+
+
+    def _deinitAnalog(self, mark_unused=False):
+        self._deinitPWM()
         if self._analogin:
             self._analogin.deinit()
             self._analogin = None
@@ -1591,9 +2388,7 @@ class MicroBitAnalogDigitalPin(MicroBitDigitalPin):
 
     def _analog(self, direction):
         if direction == "in":
-            if self._pwm:
-                self._pwm.deinit()   ### check this exists! TODO
-                self._pwm = None
+            self._deinitPWM()
             if self._analogin is None:
                 self._analogin = analogio.AnalogIn(self.pin)
             self._mode = "read_analog"  ### microbit is unused for read_analog()
@@ -1603,26 +2398,27 @@ class MicroBitAnalogDigitalPin(MicroBitDigitalPin):
             if self._analogin:
                 self._analogin.deinit()
                 self._analogin = None
-            if self._pwm is None:
-                self._frequency = self.DEFAULT_FREQUENCY
-                ### TODO - review fixed use of variable_frequency=True here
-                ### as it's probably dramatically lowering number of PWM outputs
-                self._pwm = pulseio.PWMOut(self.pin,
-                                           frequency=self._frequency,
-                                           duty_cycle=0,
-                                           variable_frequency=True)
+            self._initPWM(direction == "music_out")
             ### microbit mode is unused for write_analog(0)
             ### https://forum.micropython.org/viewtopic.php?t=8933&p=50377
             self._mode = "write_analog" if direction == "out" else "music"
             self._deinit = self._deinitAnalog
 
 
-    def read_analog(self):
+    def _readAnalog(self):
         if self._mode != "read_analog":
             self._deinit()
             self._analog("in")
 
-        rv = self._analogin.value >> 6  ### convert to 0-1023
+        return self._analogin.value >> 6  ### convert to 0-1023
+
+
+    def read_analog(self):
+        if StimulusRecorder.active:
+            rv = StimulusRecorder.active.input(self.pin_name + ".read_analog",
+                                               self._readAnalog)
+        else:
+            rv = self._readAnalog()
         self._runHooks("read_analog", "post", rv)
         return rv
 
@@ -1648,9 +2444,25 @@ class MicroBitAnalogDigitalPin(MicroBitDigitalPin):
 
     def set_analog_period_microseconds(self, period):
         ### Change it if set but do not turn PWM on yet if not set
-        self._frequency = round(1e6 / period)
-        if self._pwm:
-            self._pwm.frequency = self._frequency
+        frequency = round(1e6 / period)
+        if self._pwm and not self._pwm_variable:
+            ### A fixed frequency PWMOut has to be replaced to move
+            ### to the timer for the new period, the pin cannot have two
+            ### so the old one is put back if the new one fails
+            duty_cycle = self._pwm.duty_cycle
+            old_frequency = self._frequency
+            self._deinitPWM()
+            self._frequency = frequency
+            try:
+                self._initPWM(False)
+            except (RuntimeError, ValueError):
+                self._frequency = old_frequency
+                self._initPWM(False)
+                self._pwm.duty_cycle = duty_cycle
+                raise
+            self._pwm.duty_cycle = duty_cycle
+        else:
+            self._frequency = frequency
 
 
     def music_on(self):
@@ -1706,30 +2518,264 @@ class MicroBitTouchPin(MicroBitAnalogDigitalPin):
             self._deinit = self._deinitTouch
 
 
-    def is_touched(self):
+    def _isTouched(self):
         if self._mode != "touch":
             self._deinit()
             self._touch()
 
         ### The micro:bit touch works differently and some circuits
         ### may briefly ground the pin to simulate touch
-        rv = (self._touchpad.value
-              or self._touchpad.raw_value <= self._MICROBIT_GND_TOUCH)
+        return bool(self._touchpad.value
+                    or self._touchpad.raw_value <= self._MICROBIT_GND_TOUCH)
+
+
+    def is_touched(self):
+        if StimulusRecorder.active:
+            rv = StimulusRecorder.active.input(self.pin_name + ".is_touched",
+                                               self._isTouched)
+        else:
+            rv = self._isTouched()
 
         self._runHooks("touch", "post", rv)
         return rv
 
 
+class GestureEngine:
+    """Samples an accelerometer at a fixed rate from the background scheduler
+       into a ring buffer and classifies the micro:bit gestures incrementally
+       using the same approach as the micro:bit DAL. Postures need to be
+       steady for GESTURE_DAMPING samples, shake is detected by counting
+       strong reversals on any axis and the impulses are immediate.
+       """
+
+    GESTURES = ("", "up", "down", "left", "right", "face up", "face down",
+                "freefall", "3g", "6g", "8g", "shake")
+    NONE = 0
+    UP = 1
+    DOWN = 2
+    LEFT = 3
+    RIGHT = 4
+    FACE_UP = 5
+    FACE_DOWN = 6
+    FREEFALL = 7
+    THREE_G = 8
+    SIX_G = 9
+    EIGHT_G = 10
+    SHAKE = 11
+
+    SAMPLE_PERIOD_MS = 20
+    SAMPLES_LEN = 32
+    HISTORY_LEN = 8
+
+    ### All in milli-g
+    TILT_TOLERANCE = 200
+    FREEFALL_TOLERANCE = 400
+    SHAKE_TOLERANCE = 400
+    THREE_G_THRESHOLD = 3072
+    SIX_G_THRESHOLD = 6144
+    EIGHT_G_THRESHOLD = 8192
+
+    SHAKE_COUNT_THRESHOLD = 4
+    SHAKE_DAMPING = 10
+    GESTURE_DAMPING = 5
+
+    def __init__(self, accelerometer):
+        self._accelerometer = accelerometer
+        self._task = None
+
+        ### x, y, z interleaved with the micro:bit's signs
+        self.samples = array.array("h", [0] * (3 * self.SAMPLES_LEN))
+        self._sample_next = 0
+        self.sample_count = 0
+
+        self.current = self.NONE
+        self._candidate = self.NONE
+        self._sigma = 0
+
+        self._shake_sign = 0x00  ### a bit per axis
+        self._shake_count = 0
+        self._shake_timer = 0
+        self._shaken = False
+
+        self._history = bytearray(self.HISTORY_LEN)
+        self._history_next = 0
+        self._history_count = 0
+        self._seen = 0x000  ### a bit per gesture for wasGesture()
+
+
+    def start(self):
+        if self._task is None:
+            self._task = self.update
+            scheduler.addTask(self._task, self.SAMPLE_PERIOD_MS)
+
+
+    def stop(self):
+        if self._task is not None:
+            scheduler.removeTask(self._task)
+            self._task = None
+
+
+    def update(self):
+        ### The CLUE's LSM6DS33 reads +1g on the axis pointing up, e.g. z when
+        ### face up, where the micro:bit reads -1g so the values are mapped
+        ### to the micro:bit's signs once here for the DAL thresholds
+        raw_x, raw_y, raw_z = self._accelerometer._readValues()  ### pylint: disable=protected-access
+        x, y, z = -raw_x, -raw_y, -raw_z
+
+        idx = self._sample_next * 3
+        self.samples[idx] = max(-32768, min(x, 32767))
+        self.samples[idx + 1] = max(-32768, min(y, 32767))
+        self.samples[idx + 2] = max(-32768, min(z, 32767))
+        self._sample_next = (self._sample_next + 1) % self.SAMPLES_LEN
+        self.sample_count += 1
+
+        gesture = self._classify(x, y, z)
+        if gesture >= self.THREE_G:
+            ### Impulses and shake do not need damping
+            if gesture != self.current:
+                self._report(gesture)
+            self._candidate = gesture
+            self._sigma = 0
+            return
+
+        if gesture == self._candidate:
+            if self._sigma < self.GESTURE_DAMPING:
+                self._sigma += 1
+        else:
+            self._candidate = gesture
+            self._sigma = 0
+
+        if self._candidate != self.current and self._sigma >= self.GESTURE_DAMPING:
+            self._report(self._candidate)
+
+
+    def _updateShake(self, x, y, z):
+        detected = False
+        mask = 0x01
+        for value in (x, y, z):
+            if ((value < -self.SHAKE_TOLERANCE and self._shake_sign & mask)
+                    or (value > self.SHAKE_TOLERANCE and not self._shake_sign & mask)):
+                detected = True
+                self._shake_sign ^= mask
+            mask <<= 1
+
+        if detected and self._shake_count < self.SHAKE_COUNT_THRESHOLD:
+            self._shake_count += 1
+            if self._shake_count == self.SHAKE_COUNT_THRESHOLD:
+                self._shaken = True
+
+        self._shake_timer += 1
+        if self._shake_timer >= self.SHAKE_DAMPING:
+            self._shake_timer = 0
+            if self._shake_count > 0:
+                self._shake_count -= 1
+                if self._shake_count == 0:
+                    self._shaken = False
+
+
+    def _classify(self, x, y, z):
+        self._updateShake(x, y, z)
+        if self._shaken:
+            return self.SHAKE
+
+        force = x * x + y * y + z * z
+        if force < self.FREEFALL_TOLERANCE * self.FREEFALL_TOLERANCE:
+            return self.FREEFALL
+        if force > self.EIGHT_G_THRESHOLD * self.EIGHT_G_THRESHOLD:
+            return self.EIGHT_G
+        if force > self.SIX_G_THRESHOLD * self.SIX_G_THRESHOLD:
+            return self.SIX_G
+        if force > self.THREE_G_THRESHOLD * self.THREE_G_THRESHOLD:
+            return self.THREE_G
+
+        tilt_limit = 1000 - self.TILT_TOLERANCE
+        if x < -tilt_limit:
+            return self.LEFT
+        if x > tilt_limit:
+            return self.RIGHT
+        if y < -tilt_limit:
+            return self.DOWN
+        if y > tilt_limit:
+            return self.UP
+        if z < -tilt_limit:
+            return self.FACE_UP
+        if z > tilt_limit:
+            return self.FACE_DOWN
+        return self.NONE
+
+
+    def _report(self, gesture):
+        self.current = gesture
+        if gesture == self.NONE:
+            return
+        self._seen |= 1 << gesture
+        self._history[self._history_next] = gesture
+        self._history_next = (self._history_next + 1) % self.HISTORY_LEN
+        if self._history_count < self.HISTORY_LEN:
+            self._history_count += 1
+
+
+    def wasGesture(self, gesture):
+        mask = 1 << gesture
+        seen = bool(self._seen & mask)
+        self._seen &= ~mask
+        return seen
+
+
+    def history(self):
+        """Return and clear the recent gestures, oldest first."""
+        idx = (self._history_next - self._history_count) % self.HISTORY_LEN
+        gestures = []
+        for _ in range(self._history_count):
+            gestures.append(self._history[idx])
+            idx = (idx + 1) % self.HISTORY_LEN
+        self._history_count = 0
+        return tuple(gestures)
+
+
 class MicroBitAccelerometer:
-    """Units are milli-gravity where gravity is 9.80665ms-2."""
+    """Units are milli-gravity where gravity is 9.80665ms-2.
+       A sample of all three axes is read from the sensor in one go and
+       reused for staleness_ms, None for this uses the sensor's
+       output data rate period.
+       """
 
     ### This undoes the scaling within LSM6DS class
     _ACCEL_TO_MILLI_G = 101.9716
 
+    _DEFAULT_STALENESS_MS = 5
+    _HUB_NAME = "accelerometer"
 
-    def __init__(self, i2c=board.I2C()):
+    ### LSM6DS33 FIFO registers
+    _FIFO_CTRL3 = 0x08
+    _FIFO_CTRL5 = 0x0a
+    _FIFO_STATUS1 = 0x3a
+    _FIFO_STATUS3 = 0x3c
+    _FIFO_DATA_OUT_L = 0x3e
+    _FIFO_MODE_BYPASS = 0b000
+    _FIFO_MODE_CONTINUOUS = 0b110
+    _FIFO_OVER_RUN = 0x40  ### in FIFO_STATUS2
+    _FIFO_CHUNK_SAMPLES = 32
+
+
+    def __init__(self, i2c=board.I2C(), *, staleness_ms=_DEFAULT_STALENESS_MS):
         self._i2c = i2c
         self._accel = None
+        self._sample = None
+        self._sample_ns = 0
+        self._staleness_ms = None
+        self._staleness_ns = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.staleness_ms = staleness_ms
+        self._gesture_engine = None
+        self._hub = None
+        self._streaming = False
+        self._reg_buf = bytearray(2)
+        self._status_buf = bytearray(4)
+        self._fifo_buf = bytearray(self._FIFO_CHUNK_SAMPLES * 6)
+        self._mg_per_lsb = None
+        self.fifo_overruns = 0
 
 
     def _init(self):
@@ -1740,44 +2786,236 @@ class MicroBitAccelerometer:
             raise
 
 
-    def get_x(self):
+    def _odrPeriodMs(self):
+        """The period of the output data rate, this needs the accelerometer."""
+        try:
+            rate_hz = adafruit_lsm6ds.Rate.string[self._accel.accelerometer_data_rate]
+            return 1000.0 / rate_hz
+        except (AttributeError, KeyError, NameError, TypeError, ZeroDivisionError):
+            return self._DEFAULT_STALENESS_MS
+
+
+    @property
+    def staleness_ms(self):
+        return self._staleness_ms
+
+    @staleness_ms.setter
+    def staleness_ms(self, value):
+        self._staleness_ms = value
+        if value is None:
+            self._staleness_ns = (None if self._accel is None
+                                  else round(self._odrPeriodMs() * _MILLI_TO_NANO))
+        else:
+            self._staleness_ns = round(value * _MILLI_TO_NANO)
+
+
+    def _busRead(self):
         if self._accel is None:
             self._init()
-        return round(self._accel.acceleration[0] * self._ACCEL_TO_MILLI_G)
+            if self._staleness_ns is None:
+                self.staleness_ms = None  ### recalculate from data rate
+        return tuple(round(av * self._ACCEL_TO_MILLI_G) for av in self._accel.acceleration)
+
+
+    def _readValues(self):
+        if self._hub is not None:
+            return self._hub.latest(self._HUB_NAME)
+
+        now_ns = time.monotonic_ns()
+        if self._sample is not None and now_ns - self._sample_ns < self._staleness_ns:
+            self.cache_hits += 1
+            return self._sample
+
+        self.cache_misses += 1
+        self._sample = self._busRead()
+        self._sample_ns = now_ns
+        return self._sample
+
+
+    def _values(self):
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input("accelerometer", self._readValues)
+        return self._readValues()
+
+
+    def get_x(self):
+        return self._values()[0]
 
 
     def get_y(self):
+        return self._values()[1]
+
+
+    def get_z(self):
+        return self._values()[2]
+
+
+    def get_values(self):
+        return self._values()
+
+
+    def _configChanged(self):
+        self._sample = None
+        if self._staleness_ms is None:
+            self.staleness_ms = None
+        if self._streaming:
+            self._mg_per_lsb = adafruit_lsm6ds.AccelRange.lsb[self._accel.accelerometer_range]
+            self._fifoMode(self._FIFO_MODE_CONTINUOUS)
+
+
+    def set_range(self, value):
+        """Set the range in g to the closest supported value of 2, 4, 8 or 16."""
         if self._accel is None:
             self._init()
-        return round(self._accel.acceleration[1] * self._ACCEL_TO_MILLI_G)
+        ranges = adafruit_lsm6ds.AccelRange.string
+        self._accel.accelerometer_range = min(ranges,
+                                              key=lambda r: abs(ranges[r] - value))
+        self._configChanged()
 
 
-    def get_z(self):
+    ### Extras
+
+    def set_data_rate(self, rate_hz):
+        """Set the output data rate to the closest supported value in Hz."""
         if self._accel is None:
             self._init()
-        return round(self._accel.acceleration[2] * self._ACCEL_TO_MILLI_G)
+        rates = adafruit_lsm6ds.Rate.string
+        self._accel.accelerometer_data_rate = min((r for r in rates if rates[r]),
+                                                  key=lambda r: abs(rates[r] - rate_hz))
+        self._configChanged()
 
 
-    def get_values(self):
+    def _writeReg(self, reg, value):
+        self._reg_buf[0] = reg
+        self._reg_buf[1] = value
+        with self._accel.i2c_device as i2c:
+            i2c.write(self._reg_buf, end=2)
+
+
+    def _readRegs(self, reg, buf, length):
+        self._reg_buf[0] = reg
+        with self._accel.i2c_device as i2c:
+            i2c.write_then_readinto(self._reg_buf, buf, out_end=1, in_end=length)
+
+
+    def _fifoMode(self, mode):
+        ### Only the accelerometer goes into the FIFO with no decimation
+        self._writeReg(self._FIFO_CTRL3, 0b000001)
+        ### The FIFO ODR uses the same codes as the accelerometer ODR
+        odr = self._accel.accelerometer_data_rate if mode != self._FIFO_MODE_BYPASS else 0
+        self._writeReg(self._FIFO_CTRL5, (odr << 3) | mode)
+
+
+    def start_streaming(self, rate_hz=None):
+        """Start filling the sensor's FIFO in continuous mode for draining in
+           bulk with get_values_into()."""
         if self._accel is None:
             self._init()
-        return tuple(round(av * self._ACCEL_TO_MILLI_G) for av in self._accel.acceleration)
+        if rate_hz is not None:
+            self.set_data_rate(rate_hz)
+        self._streaming = True
+        self._configChanged()
+
+
+    def stop_streaming(self):
+        if self._streaming:
+            self._fifoMode(self._FIFO_MODE_BYPASS)
+            self._streaming = False
+
+
+    def _getValuesInto(self, buffer):
+        if not self._streaming:
+            for idx, value in enumerate(self._readValues()):
+                buffer[idx] = value
+            return 1
+
+        ### FIFO_STATUS1-4 give unread words, flags and the next word's axis
+        status = self._status_buf
+        self._readRegs(self._FIFO_STATUS1, status, 4)
+        if status[1] & self._FIFO_OVER_RUN:
+            self.fifo_overruns += 1
+        words = status[0] | (status[1] & 0x0f) << 8
+        pattern = status[2] | (status[3] & 0x03) << 8
+
+        ### Discard any words for a partially read sample
+        if pattern:
+            skip = 3 - pattern
+            self._readRegs(self._FIFO_DATA_OUT_L, self._fifo_buf, skip * 2)
+            words -= skip
+
+        samples = min(words // 3, len(buffer) // 3)
+        mg_per_lsb = self._mg_per_lsb
+        out_idx = 0
+        while out_idx < samples * 3:
+            ### The address rolls over to FIFO_DATA_OUT_L for burst reads
+            chunk_words = min(samples * 3 - out_idx, self._FIFO_CHUNK_SAMPLES * 3)
+            self._readRegs(self._FIFO_DATA_OUT_L, self._fifo_buf, chunk_words * 2)
+            for b_idx in range(0, chunk_words * 2, 2):
+                raw = self._fifo_buf[b_idx] | self._fifo_buf[b_idx + 1] << 8
+                if raw >= 0x8000:
+                    raw -= 0x10000
+                buffer[out_idx] = round(raw * mg_per_lsb)
+                out_idx += 1
+        return samples
+
+
+    def get_values_into(self, buffer):
+        """Fill buffer with x, y, z values in milli-g from the FIFO and return
+           the number of samples, i.e. triplets. This reads one sample if
+           start_streaming() has not been called."""
+        if StimulusRecorder.active:
+            values = StimulusRecorder.active.input("accelerometer.get_values_into",
+                                                   lambda: tuple(buffer[:3 * self._getValuesInto(buffer)]))
+            for idx, value in enumerate(values):
+                buffer[idx] = value
+            return len(values) // 3
+        return self._getValuesInto(buffer)
+
+
+    def _gestures(self):
+        if self._gesture_engine is None:
+            self._gesture_engine = GestureEngine(self)
+            self._gesture_engine.start()
+        scheduler.run()
+        return self._gesture_engine
+
+
+    def _gestureInput(self, query, func):
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input("accelerometer." + query, func)
+        return func()
+
+
+    @staticmethod
+    def _gestureIndex(name):
+        try:
+            return GestureEngine.GESTURES.index(name)
+        except ValueError:
+            raise ValueError("invalid gesture")
 
 
     def current_gesture(self):
-        raise NotImplementedError
+        return GestureEngine.GESTURES[self._gestureInput("current_gesture",
+                                                         lambda: self._gestures().current)]
 
 
-    def is_gesture(self):
-        raise NotImplementedError
+    def is_gesture(self, name):
+        self._gestureIndex(name)
+        return self.current_gesture() == name
 
 
-    def was_gesture(self):
-        raise NotImplementedError
+    def was_gesture(self, name):
+        """True if the gesture has been seen since the last call for that gesture."""
+        g_idx = self._gestureIndex(name)
+        return self._gestureInput("was_gesture." + name,
+                                  lambda: self._gestures().wasGesture(g_idx))
 
 
     def get_gestures(self):
-        raise NotImplementedError
+        """A tuple of the gestures seen since the last call, oldest first."""
+        return tuple(GestureEngine.GESTURES[g_idx]
+                     for g_idx in self._gestureInput("get_gestures",
+                                                     lambda: self._gestures().history()))
 
 
     @property
@@ -1789,27 +3027,176 @@ class MicroBitAccelerometer:
 ### https://github.com/bbcmicrobit/micropython/blob/master/source/microbit/microbitcompass.cpp    pylint:disable=line-too-long
 ### https://github.com/lancaster-university/microbit-dal/blob/master/source/drivers/MicroBitCompass.cpp    pylint:disable=line-too-long
 
-def _scToNed(x, y, z):
-    return (y, x, -z)
-
-
 def _accelToPitchRoll(x, y, z):
     roll = math.atan2(x, -z)
     pitch = math.atan2(y, (x * math.sin(roll) - z * math.cos(roll)))
     return (pitch, roll)
 
 
+class CompassCalibration:
+    """Hard and soft iron correction for a magnetometer held as an offset
+       and a 3x3 matrix so correcting a sample is a fixed amount of work.
+       The fit is calculated from a stream of samples using the per axis
+       minimum and maximum values.
+       The calibration is stored as a versioned record in
+       microcontroller.nvm at NVM_OFFSET or in FILENAME if there is no nvm.
+       NVM_OFFSET of None puts the record in the last bytes of nvm
+       leaving the start, which programs often use, free.
+       """
+
+    MAGIC = b"MBCC"
+    VERSION = 1
+    NVM_OFFSET = None  ### None is the end of nvm
+    FILENAME = "compass_calibration.bin"
+
+    ### magic, version, offset x, y, z, matrix by row
+    _RECORD_FMT = "<4sB12f"
+    _RECORD_LEN = struct.calcsize(_RECORD_FMT)
+
+    def __init__(self, offset=(0.0, 0.0, 0.0),
+                 matrix=(1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)):
+        self.offset = tuple(offset)
+        self.matrix = tuple(matrix)
+        self._min = [None, None, None]
+        self._max = [None, None, None]
+        self.samples = 0
+
+
+    def addSample(self, x, y, z):
+        self.samples += 1
+        for axis, value in enumerate((x, y, z)):
+            if self._min[axis] is None or value < self._min[axis]:
+                self._min[axis] = value
+            if self._max[axis] is None or value > self._max[axis]:
+                self._max[axis] = value
+
+
+    def span(self, axis):
+        if self._min[axis] is None:
+            return 0
+        return self._max[axis] - self._min[axis]
+
+
+    def fit(self):
+        """Calculate the offset for hard iron and a diagonal matrix
+           scaling each axis to the mean radius for soft iron."""
+        if self.samples == 0:
+            raise ValueError("No samples")
+        self.offset = tuple((self._max[axis] + self._min[axis]) / 2 for axis in range(3))
+        radii = [max(self.span(axis) / 2, 1e-6) for axis in range(3)]
+        mean_radius = sum(radii) / 3
+        self.matrix = (mean_radius / radii[0], 0.0, 0.0,
+                       0.0, mean_radius / radii[1], 0.0,
+                       0.0, 0.0, mean_radius / radii[2])
+
+
+    def apply(self, x, y, z):
+        x -= self.offset[0]
+        y -= self.offset[1]
+        z -= self.offset[2]
+        mat = self.matrix
+        return (mat[0] * x + mat[1] * y + mat[2] * z,
+                mat[3] * x + mat[4] * y + mat[5] * z,
+                mat[6] * x + mat[7] * y + mat[8] * z)
+
+
+    def toBytes(self):
+        return struct.pack(self._RECORD_FMT, self.MAGIC, self.VERSION,
+                           *(self.offset + self.matrix))
+
+
+    @classmethod
+    def fromBytes(cls, data):
+        """Return a CompassCalibration or None if data is not a valid record."""
+        if len(data) < cls._RECORD_LEN:
+            return None
+        fields = struct.unpack_from(cls._RECORD_FMT, data)
+        if fields[0] != cls.MAGIC or fields[1] != cls.VERSION:
+            return None
+        return cls(offset=fields[2:5], matrix=fields[5:14])
+
+
+    @classmethod
+    def _nvmOffset(cls, nvm):
+        offset = len(nvm) - cls._RECORD_LEN if cls.NVM_OFFSET is None else cls.NVM_OFFSET
+        if offset < 0 or offset + cls._RECORD_LEN > len(nvm):
+            raise ValueError("Calibration record does not fit in nvm at "
+                             + str(cls.NVM_OFFSET))
+        return offset
+
+
+    def save(self):
+        data = self.toBytes()
+        nvm = getattr(microcontroller, "nvm", None)
+        if nvm is not None:
+            offset = self._nvmOffset(nvm)
+            nvm[offset:offset + len(data)] = data
+        else:
+            with open(self.FILENAME, "wb") as file:
+                file.write(data)
+
+
+    @classmethod
+    def load(cls):
+        nvm = getattr(microcontroller, "nvm", None)
+        if nvm is not None:
+            offset = cls._nvmOffset(nvm)
+            return cls.fromBytes(bytes(nvm[offset:offset + cls._RECORD_LEN]))
+        try:
+            with open(cls.FILENAME, "rb") as file:
+                return cls.fromBytes(file.read())
+        except OSError:
+            return None
+
+
+    @classmethod
+    def clear(cls):
+        nvm = getattr(microcontroller, "nvm", None)
+        if nvm is not None:
+            offset = cls._nvmOffset(nvm)
+            nvm[offset:offset + len(cls.MAGIC)] = bytes(len(cls.MAGIC))
+        else:
+            try:
+                os.remove(cls.FILENAME)
+            except OSError:
+                pass
+
+
 ### TODO - micro:bit calibrates if not calibrated when methods
 ### are called that return data
-### ponder storage using nvm module for eeprom-like storage
-### could use magic identifer number a la microbit and NaN for NA numbers
 class MicroBitCompass:
-    def __init__(self, i2c=board.I2C(), accel=None):
+    _HUB_NAME = "compass"
+
+    ### calibrate() finishes when each axis spans this or on the timeout
+    CALIBRATION_SPAN = 40000  ### nT
+    CALIBRATION_TIMEOUT_MS = 30000
+    CALIBRATION_PERIOD_MS = 20
+
+    _DEFAULT_STALENESS_MS = 5
+
+    def __init__(self, i2c=board.I2C(), accel=None,
+                 *, staleness_ms=_DEFAULT_STALENESS_MS, tilt_compensation=False):
+        """accel is a MicroBitAccelerometer for tilt compensation which is
+           off by default until tilted readings have been checked against
+           a micro:bit, set the tilt_compensation attribute to use it."""
         self._i2c = i2c
         self._accel = accel
         self._mag = None
+        self._calibration = None
         self._calibrated = False
-        self._tilt_compensation = False
+        self.tilt_compensation = tilt_compensation
+        self._sample = None
+        self._sample_ns = 0
+        self._staleness_ns = round(staleness_ms * _MILLI_TO_NANO)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._hub = None
+
+        ### For the orientation service
+        self._orientation_task = None
+        self._smoothing = 0.0
+        self._filtered = None  ### accel x, y, z then mag x, y, z
+        self._orientation = (0, 0, 0)
 
 
     def _init(self):
@@ -1819,12 +3206,15 @@ class MicroBitCompass:
             print("ERROR:", "missing adafruit_lis3mdl library on CIRCUITPY")
             raise
 
+        self._calibration = CompassCalibration.load()
+        self._calibrated = self._calibration is not None
 
-    def _basicBearing(self):
+
+    @staticmethod
+    def _basicBearing(m_x, m_y):
         ### micro:bit facing south gives (5.41797, -26.1172, 40.3125)
         ### 4th CLUE gives (2.8062, -94.8845, 117.743)
         ### suggesting ENU coords
-        m_x, m_y, _ = self._mag.magnetic
         bearing = round(math.degrees(math.atan2(m_x, m_y)))
 
         if bearing < 0:
@@ -1833,47 +3223,131 @@ class MicroBitCompass:
         return bearing
 
 
-    ### This is based on MicroBitCompass::tiltCompensatedBearing() in
-    ### https://github.com/lancaster-university/microbit-dal/blob/master/source/drivers/MicroBitCompass.cpp    pylint:disable=line-too-long
-    def _tiltCompensatedBearing(self):
+    ### The readings above suggest the sensor axes are x left, y forward
+    ### and z down when the board is face up (right-handed). The accelerometer
+    ### reads the reaction to gravity so down is the opposite of it.
+    ### East is down x field and north is east x down, the bearing is the
+    ### angle of the forward (y) axis from north towards east. This reduces
+    ### to _basicBearing() when flat.
+    @staticmethod
+    def _tiltCompensatedBearing(accel_values, field):
         """This does not work well if the device is accelerating or
            subject to any vibration.
         """
-        pitch, roll = _accelToPitchRoll(*self._accel.acceleration)
-        m_x_ned, m_y_ned, m_z_ned = _scToNed(*self._mag.magnetic)
-
-        sinPhi = math.sin(roll)
-        cosPhi = math.cos(roll)
-        sinTheta = math.sin(pitch)
-        cosTheta = math.cos(pitch)
-
-        ### Calculate the tilt compensated bearing, and convert to degrees.
-        bearing_rad = math.atan2((0.0
-                                  - m_y_ned * cosPhi
-                                  + m_z_ned * sinPhi),
-                                 (m_x_ned * cosTheta
-                                  + m_y_ned * sinTheta * sinPhi
-                                  + m_z_ned * sinTheta * cosPhi))
-
-        bearing = round(math.degrees(bearing_rad))
+        a_x, a_y, a_z = accel_values
+        m_x, m_y, m_z = field
+        a_mag = math.sqrt(a_x * a_x + a_y * a_y + a_z * a_z)
+        if a_mag == 0:
+            return MicroBitCompass._basicBearing(m_x, m_y)
+        d_x = -a_x / a_mag
+        d_y = -a_y / a_mag
+        d_z = -a_z / a_mag
+
+        e_x = d_y * m_z - d_z * m_y
+        e_y = d_z * m_x - d_x * m_z
+        e_z = d_x * m_y - d_y * m_x
+        n_y = e_z * d_x - e_x * d_z
+
+        bearing = round(math.degrees(math.atan2(e_y, n_y)))
 
         if bearing < 0:
             bearing += 360
 
-        print("TODO - UNTESTED AND LIKELY NOT TO WORK")
-        print("TODO - UNTESTED AND REALLY LIKELY NOT TO WORK")
+        ### TODO - verify tilted readings against a micro:bit
         return bearing
 
 
+    def _bearing(self, accel_values, field):
+        if accel_values is not None and self.tilt_compensation:
+            return self._tiltCompensatedBearing(accel_values, field)
+        return self._basicBearing(field[0], field[1])
+
+
+    def _readAccel(self):
+        """The accelerometer values only if they are needed for tilt compensation."""
+        if self._accel is None or not self.tilt_compensation:
+            return None
+        return self._accel._readValues()  ### pylint: disable=protected-access
+
+
+    def _heading(self):
+        if self._orientation_task is not None:
+            scheduler.run()
+            return self._orientation[0]
+        return self._bearing(self._readAccel(), self._readField())
+
+
     def heading(self):
-        """TODO"""
-        if self._mag is None:
-            self._init()
+        """The bearing in degrees from 0 to 359, this is tilt compensated
+           if tilt_compensation is set and there is an accelerometer."""
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input("compass.heading", self._heading)
+        return self._heading()
+
+
+    ### Extras
+
+    def start_orientation(self, period_ms=50, smoothing=0.0):
+        """Read the accelerometer and magnetometer together every period_ms
+           from the background scheduler keeping the heading, pitch and roll
+           for heading() and get_orientation(). The accelerometer is only
+           read if tilt_compensation is set, pitch and roll are 0 without it.
+           smoothing from 0.0 to less than 1.0 applies a low pass filter to
+           the samples, higher values are smoother.
+           """
+        if not 0.0 <= smoothing < 1.0:
+            raise ValueError("smoothing must be 0.0 to less than 1.0")
+        self._smoothing = smoothing
+        self._filtered = None
+        self._updateOrientation()
+        if self._orientation_task is None:
+            self._orientation_task = self._updateOrientation
+            scheduler.addTask(self._orientation_task, period_ms)
+
+
+    def stop_orientation(self):
+        if self._orientation_task is not None:
+            scheduler.removeTask(self._orientation_task)
+            self._orientation_task = None
+
+
+    def _updateOrientation(self):
+        accel_values = self._readAccel()
+        field = self._readField()
+        sample = (accel_values if accel_values else (0, 0, 0)) + field
+        if self._filtered is None:
+            self._filtered = list(sample)
+        else:
+            alpha = 1.0 - self._smoothing
+            for idx, value in enumerate(sample):
+                self._filtered[idx] += alpha * (value - self._filtered[idx])
+
+        filtered = self._filtered
+        if accel_values:
+            pitch, roll = _accelToPitchRoll(filtered[0], filtered[1], filtered[2])
+            pitch = round(math.degrees(pitch))
+            roll = round(math.degrees(roll))
+            bearing = self._bearing(filtered[0:3], filtered[3:6])
+        else:
+            pitch = roll = 0
+            bearing = self._bearing(None, filtered[3:6])
+        self._orientation = (bearing, pitch, roll)
 
-        if self._accel and self._tilt_compensation:
-            return self._tiltCompensatedBearing()
 
-        return self._basicBearing()
+    def get_orientation(self):
+        """A tuple of heading, pitch and roll in degrees."""
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input("compass.get_orientation",
+                                                 self._getOrientation)
+        return self._getOrientation()
+
+
+    def _getOrientation(self):
+        if self._orientation_task is not None:
+            scheduler.run()
+        else:
+            self._updateOrientation()
+        return self._orientation
 
 
     def is_calibrated(self):
@@ -1883,52 +3357,311 @@ class MicroBitCompass:
         return self._calibrated
 
 
-    ### TODO - got an external implementation of this but need to
-    ### tidy it up and work out how to glue it in
     def calibrate(self):
+        """Collect samples while the board is rotated in all directions
+           showing progress on the display then store the calibration.
+           Returns True if enough rotation was seen before the timeout."""
+        if self._mag is None:
+            self._init()
+
+        calibration = CompassCalibration()
+        leds = STD_IMAGE_WIDTH * STD_IMAGE_HEIGHT
+        progress_image = MicroBitImage()
+        lit = 0
+        deadline_ns = time.monotonic_ns() + self.CALIBRATION_TIMEOUT_MS * _MILLI_TO_NANO
+        complete = False
+        display.scroll("TILT TO FILL SCREEN")
+        while time.monotonic_ns() < deadline_ns:
+            x, y, z = self._mag.magnetic
+            calibration.addSample(x * _MICRO_TO_NANO, y * _MICRO_TO_NANO, z * _MICRO_TO_NANO)
+            progress = min(calibration.span(axis) for axis in range(3)) / self.CALIBRATION_SPAN
+            new_lit = min(round(progress * leds), leds)
+            if new_lit != lit:
+                for idx in range(lit, new_lit):
+                    progress_image.pixels[idx] = MAX_BRIGHTNESS
+                lit = new_lit
+                display.show(progress_image)
+            if progress >= 1.0:
+                complete = True
+                break
+            scheduler.sleep(self.CALIBRATION_PERIOD_MS)
+
+        display.clear()
+        if complete:
+            calibration.fit()
+            calibration.save()
+            self._calibration = calibration
+            self._calibrated = True
+            self._sample = None
+        return complete
+
+
+    def clear_calibration(self):
+        CompassCalibration.clear()
+        self._calibration = None
+        self._calibrated = False
+        self._sample = None
+
+
+    def _busRead(self):
         if self._mag is None:
             self._init()
+        return self._convertField(*self._mag.magnetic)
+
+
+    def _readField(self):
+        if self._hub is not None:
+            return self._hub.latest(self._HUB_NAME)
+
+        now_ns = time.monotonic_ns()
+        if self._sample is not None and now_ns - self._sample_ns < self._staleness_ns:
+            self.cache_hits += 1
+            return self._sample
+
+        self.cache_misses += 1
+        self._sample_ns = now_ns
+        self._sample = self._busRead()
+        return self._sample
+
+
+    def _convertField(self, x, y, z):
+        if self._calibration is not None:
+            x, y, z = self._calibration.apply(x * _MICRO_TO_NANO,
+                                              y * _MICRO_TO_NANO,
+                                              z * _MICRO_TO_NANO)
+            return (round(x), round(y), round(z))
+        return (round(x * _MICRO_TO_NANO), round(y * _MICRO_TO_NANO), round(z * _MICRO_TO_NANO))
+
+
+    def _field(self):
+        """The magnetic field in nano tesla."""
+        if StimulusRecorder.active:
+            return StimulusRecorder.active.input("compass", self._readField)
+        return self._readField()
 
 
     def get_x(self):
         """Gives the reading of the magnetic field strength on the x axis
            in nano tesla, as a positive or negative integer,
             depending on the direction of the field."""
-        if self._mag is None:
-            self._init()
-
-        x, _, _ = self._mag.magnetic
-        return round(x * _MICRO_TO_NANO)
+        return self._field()[0]
 
 
     def get_y(self):
         """Gives the reading of the magnetic field strength on the y axis
            in nano tesla, as a positive or negative integer,
             depending on the direction of the field."""
-        if self._mag is None:
-            self._init()
-
-        _, y, _ = self._mag.magnetic
-        return round(y * _MICRO_TO_NANO)
+        return self._field()[1]
 
 
     def get_z(self):
         """Gives the reading of the magnetic field strength on the z axis
            in nano tesla, as a positive or negative integer,
             depending on the direction of the field."""
-        if self._mag is None:
-            self._init()
-
-        _, _, z = self._mag.magnetic
-        return round(z * _MICRO_TO_NANO)
+        return self._field()[2]
 
 
     def get_field_strength(self):
-        if self._mag is None:
-            self._init()
+        x, y, z = self._field()
+        return round(math.sqrt(x * x + y * y + z * z))
+
+
+### Polls the I2C sensors from a single scheduler task so their
+### transactions are batched back-to-back on the shared bus each tick
+### rather than interleaved on demand by every get_x() etc
+### Sensors need a _busRead() method, a _hub attribute and _HUB_NAME
+class SensorHub:
+    TICK_MS = 10
+
+    def __init__(self, i2c, *, tick_ms=TICK_MS):
+        self.i2c = i2c
+        self._tick_ns = round(tick_ms * _MILLI_TO_NANO)
+        ### Each is [name, sensor, period_ns, due_ns, latency, late, missed]
+        self._sensors = []
+        self._task = self._tick  ### bound method kept for removeTask()
+        self._running = False
+
+        ### The latest value from each sensor and when it was read
+        self.snapshot = {}
+        self.snapshot_ns = {}
+
+        self.ticks = 0
+        self._busy_ns = 0
+        self._stats_start_ns = time.monotonic_ns()
+
+
+    def add(self, sensor, period_ms):
+        """Register sensor to be read every period_ms, this reads it once
+           immediately so any problem with the sensor surfaces here."""
+        self.remove(sensor)
+        name = sensor._HUB_NAME  ### pylint: disable=protected-access
+        period_ns = max(self._tick_ns, round(period_ms * _MILLI_TO_NANO))
+        entry = [name, sensor, period_ns, 0, PulseStats(), 0, 0]
+        self._read(entry, time.monotonic_ns())
+        self._sensors.append(entry)
+        sensor._hub = self  ### pylint: disable=protected-access
+        if not self._running:
+            scheduler.addTask(self._task, self._tick_ns / _MILLI_TO_NANO)
+            self._running = True
+
+
+    def remove(self, sensor):
+        """Return sensor to reading the bus on demand."""
+        before = len(self._sensors)
+        self._sensors = [e for e in self._sensors if e[1] is not sensor]
+        if len(self._sensors) == before:
+            return
+        sensor._hub = None  ### pylint: disable=protected-access
+        self.snapshot.pop(sensor._HUB_NAME, None)  ### pylint: disable=protected-access
+        self.snapshot_ns.pop(sensor._HUB_NAME, None)  ### pylint: disable=protected-access
+        if self._running and not self._sensors:
+            scheduler.removeTask(self._task)
+            self._running = False
+
+
+    def _read(self, entry, now_ns):
+        sensor = entry[1]
+        start_ns = time.monotonic_ns()
+        value = sensor._busRead()  ### pylint: disable=protected-access
+        end_ns = time.monotonic_ns()
+
+        self.snapshot[entry[0]] = value
+        self.snapshot_ns[entry[0]] = end_ns
+        entry[4].add((end_ns - start_ns) // _MICRO_TO_NANO)
+        self._busy_ns += end_ns - start_ns
+
+        ### The first read sets the schedule, after that work out
+        ### if this was late and how many periods were skipped
+        period_ns = entry[2]
+        if entry[3]:
+            lateness_ns = start_ns - entry[3]
+            if lateness_ns > self._tick_ns:
+                entry[5] += 1
+            skipped = lateness_ns // period_ns
+            entry[6] += skipped
+            entry[3] += (skipped + 1) * period_ns
+        else:
+            entry[3] = now_ns + period_ns
+
+
+    def _tick(self):
+        self.ticks += 1
+        now_ns = time.monotonic_ns()
+        for entry in self._sensors:
+            if now_ns >= entry[3]:
+                self._read(entry, now_ns)
+
+
+    def latest(self, name):
+        """The most recent reading from the named sensor,
+           this runs any background tasks which are due first."""
+        scheduler.run()
+        return self.snapshot[name]
+
+
+    def stats(self, name):
+        """Returns a dict with the read count, latency in microseconds
+           and count of late and missed reads for the named sensor."""
+        for entry in self._sensors:
+            if entry[0] == name:
+                latency = entry[4]
+                return {"period_ms": entry[2] / _MILLI_TO_NANO,
+                        "reads": latency.count,
+                        "latency_us": latency.mean,
+                        "latency_max_us": latency.max,
+                        "late": entry[5],
+                        "missed": entry[6]}
+        raise ValueError("sensor not registered")
+
+
+    @property
+    def utilisation(self):
+        """Fraction of time since the last reset_stats() spent
+           reading the bus, values near 1.0 mean the rates are too high."""
+        elapsed_ns = time.monotonic_ns() - self._stats_start_ns
+        return self._busy_ns / elapsed_ns if elapsed_ns > 0 else 0.0
+
+
+    def reset_stats(self):
+        for entry in self._sensors:
+            entry[4].reset()
+            entry[5] = 0
+            entry[6] = 0
+        self.ticks = 0
+        self._busy_ns = 0
+        self._stats_start_ns = time.monotonic_ns()
 
-        x, y, z = self._mag.magnetic
-        return round(math.sqrt(x * x + y * y + z * z) * _MICRO_TO_NANO)
+
+### Keeps track of the PWM timers so analog outputs at the same period share
+### one and music always has one available
+### The nRF52840 has four PWM peripherals each with four channels sharing a
+### period, the CLUE's display backlight takes one of them
+class PWMManager:
+    TIMERS = 3
+    CHANNELS = 4
+    MUSIC_TIMERS = 1  ### only music can use these
+    timers = []  ### Each is [frequency, variable, [owners]]
+    failures = 0
+
+
+    @staticmethod
+    def _name(owner):
+        return getattr(owner, "pin_name", type(owner).__name__)
+
+
+    @classmethod
+    def _reserveLeft(cls):
+        ### The speaker's PWMAudioOut is not music on a pin
+        music_in_use = sum(1 for timer in cls.timers
+                           if timer[1] and not isinstance(timer[2][0], ClueSpeaker))
+        return max(0, cls.MUSIC_TIMERS - music_in_use)
+
+
+    @classmethod
+    def claim(cls, owner, frequency, *, variable=False):
+        """Record owner using a PWM channel at frequency, variable frequency
+           needs a timer to itself. Raises RuntimeError if none is free."""
+        cls.release(owner)
+        free = cls.TIMERS - len(cls.timers)
+        if variable:
+            if free > 0:
+                cls.timers.append([frequency, True, [owner]])
+                return
+        else:
+            for timer in cls.timers:
+                if (not timer[1] and timer[0] == frequency
+                        and len(timer[2]) < cls.CHANNELS):
+                    timer[2].append(owner)
+                    return
+            if free > cls._reserveLeft():
+                cls.timers.append([frequency, False, [owner]])
+                return
+
+        cls.failures += 1
+        raise RuntimeError("All timers in use for "
+                           + ("music" if variable else str(frequency) + "Hz PWM")
+                           + " on " + cls._name(owner))
+
+
+    @classmethod
+    def release(cls, owner):
+        for timer in cls.timers:
+            if owner in timer[2]:
+                timer[2].remove(owner)
+        cls.timers = [timer for timer in cls.timers if timer[2]]
+
+
+    @classmethod
+    def usage(cls):
+        """Returns a dict with the capacity and what is using each timer."""
+        return {"timers": cls.TIMERS,
+                "channels": cls.CHANNELS,
+                "music_reserved": cls.MUSIC_TIMERS,
+                "free": cls.TIMERS - len(cls.timers),
+                "failures": cls.failures,
+                "in_use": [(timer[0], timer[1],
+                            tuple(cls._name(owner) for owner in timer[2]))
+                           for timer in cls.timers]}
 
 
 class PinManager:
@@ -1949,10 +3682,372 @@ class PinManager:
         return count
 
 
-### TODO - ponder some sort of background tick thing to call any periodic stuff
-### what's a reasonable target frequency? 50 Hz?
-### 1) display update
-### 2) button update (gamepad looks like it does a good job of this as clue object uses that)
+def _trace_write_digital_cb(pin_obj, recorder, value):
+    recorder.record(pin_obj, 0, value)
+
+
+def _trace_read_digital_cb(pin_obj, recorder, value):
+    recorder.record(pin_obj, 1, value)
+
+
+def _trace_write_analog_cb(pin_obj, recorder, value):
+    recorder.record(pin_obj, 2, value)
+
+
+def _trace_read_analog_cb(pin_obj, recorder, value):
+    recorder.record(pin_obj, 3, value)
+
+
+def _trace_touch_cb(pin_obj, recorder, value):
+    recorder.record(pin_obj, 4, 1 if value else 0)
+
+
+def _trace_music_frequency_cb(pin_obj, recorder, value_and_desc):
+    recorder.record(pin_obj, 5, round(value_and_desc[0]))
+
+
+class PinTraceRecorder:
+    """Records the pin activity from PinManager's pins into a ring buffer
+       which can be exported as a VCD file for a waveform viewer.
+       Each event is stored as a fixed size binary record in a preallocated
+       bytearray so recording does not allocate per event.
+       """
+
+    ### Order must match the numbers used in the _trace_*_cb functions
+    OPERATIONS = ("write_digital",
+                  "read_digital",
+                  "write_analog",
+                  "read_analog",
+                  "touch",
+                  "music_frequency")
+
+    _HOOKS = (("write_digital", _trace_write_digital_cb),
+              ("read_digital", _trace_read_digital_cb),
+              ("write_analog", _trace_write_analog_cb),
+              ("read_analog", _trace_read_analog_cb),
+              ("touch", _trace_touch_cb),
+              ("music_frequency", _trace_music_frequency_cb),
+              )
+
+    ### timestamp_ns, pin index, operation index, value
+    _RECORD_FMT = "<qBBi"
+    _RECORD_LEN = struct.calcsize(_RECORD_FMT)
+
+    ### VCD signal per pin for each class of operation
+    ### digital ones are one bit, others are 32 bit integers
+    _OP_SIGNAL = (0, 0, 1, 1, 0, 2)
+    _SIGNAL_NAMES = ("digital", "analog", "music")
+
+    def __init__(self, capacity=1024):
+        self._capacity = capacity
+        self._buffer = bytearray(capacity * self._RECORD_LEN)
+        self._pins = []
+        self._pin_index = {}
+        self._next = 0
+        self._count = 0
+        self.overwritten = 0
+        self.recording = False
+
+
+    def start(self):
+        """Start recording from all of the pins known to PinManager."""
+        if self.recording:
+            return
+        self._pins = list(PinManager.pins)
+        self._pin_index = {pin: idx for idx, pin in enumerate(self._pins)}
+        for method_name, func in self._HOOKS:
+            PinManager.addHookPins(method_name, func, self)
+        self.recording = True
+
+
+    def stop(self):
+        if not self.recording:
+            return
+        for method_name, func in self._HOOKS:
+            _ = PinManager.removeHookPins(method_name, func, self)
+        self.recording = False
+
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+        self.overwritten = 0
+
+
+    def record(self, pin_obj, op_idx, value):
+        """Store an event, overwriting the oldest one if the buffer is full."""
+        struct.pack_into(self._RECORD_FMT, self._buffer,
+                         self._next * self._RECORD_LEN,
+                         time.monotonic_ns(), self._pin_index.get(pin_obj, 255),
+                         op_idx, value)
+        self._next += 1
+        if self._next == self._capacity:
+            self._next = 0
+        if self._count < self._capacity:
+            self._count += 1
+        else:
+            self.overwritten += 1
+
+
+    def __len__(self):
+        return self._count
+
+
+    def _rawEvent(self, idx):
+        rec_idx = (self._next - self._count + idx) % self._capacity
+        return struct.unpack_from(self._RECORD_FMT, self._buffer,
+                                  rec_idx * self._RECORD_LEN)
+
+
+    def _pinName(self, pin_idx):
+        try:
+            return self._pins[pin_idx].pin_name
+        except IndexError:
+            return "unknown"
+
+
+    def events(self):
+        """A generator for (timestamp_ns, pin_name, operation, value) tuples,
+           oldest first."""
+        for idx in range(self._count):
+            ts_ns, pin_idx, op_idx, value = self._rawEvent(idx)
+            yield (ts_ns, self._pinName(pin_idx), self.OPERATIONS[op_idx], value)
+
+
+    @staticmethod
+    def _vcdId(num):
+        """Make a short VCD identifier from the printable characters ! to ~."""
+        chars = ""
+        while True:
+            chars += chr(33 + num % 94)
+            num //= 94
+            if num == 0:
+                return chars
+
+
+    def writeVCD(self, file, *, module="microbit"):
+        """Write the recorded events in Value Change Dump format to a
+           filename or a stream. Times are in nanoseconds relative to the
+           oldest recorded event.
+           """
+        if isinstance(file, str):
+            with open(file, "w") as stream:
+                self.writeVCD(stream, module=module)
+            return
+
+        ### Find which signals are in use to declare them in the header
+        signals = {}
+        for idx in range(self._count):
+            _, pin_idx, op_idx, _ = self._rawEvent(idx)
+            key = (pin_idx, self._OP_SIGNAL[op_idx])
+            if key not in signals:
+                signals[key] = self._vcdId(len(signals))
+
+        file.write("$timescale 1ns $end\n")
+        file.write("$scope module " + module + " $end\n")
+        for (pin_idx, sig_idx), vcd_id in signals.items():
+            width = 1 if sig_idx == 0 else 32
+            file.write("$var " + ("wire" if width == 1 else "integer")
+                       + " " + str(width) + " " + vcd_id + " "
+                       + self._pinName(pin_idx) + "_" + self._SIGNAL_NAMES[sig_idx]
+                       + " $end\n")
+        file.write("$upscope $end\n$enddefinitions $end\n")
+
+        file.write("#0\n$dumpvars\n")
+        for (_, sig_idx), vcd_id in signals.items():
+            file.write(("x" if sig_idx == 0 else "bx ") + vcd_id + "\n")
+        file.write("$end\n")
+
+        first_ts_ns = last_time = None
+        for idx in range(self._count):
+            ts_ns, pin_idx, op_idx, value = self._rawEvent(idx)
+            if first_ts_ns is None:
+                first_ts_ns = ts_ns
+                last_time = 0
+            rel_time = ts_ns - first_ts_ns
+            if rel_time != last_time:
+                file.write("#" + str(rel_time) + "\n")
+                last_time = rel_time
+            sig_idx = self._OP_SIGNAL[op_idx]
+            vcd_id = signals[(pin_idx, sig_idx)]
+            if sig_idx == 0:
+                file.write(("1" if value else "0") + vcd_id + "\n")
+            else:
+                file.write("b" + "{:b}".format(value & 0xffffffff) + " " + vcd_id + "\n")
+
+
+class StimulusRecorder:
+    """Captures every value read from the inputs (buttons, pins,
+       accelerometer, compass and light sensor) with a timestamp to a
+       compact binary file or replays a capture back to the program
+       without touching the hardware.
+       In replay mode values are returned in the order they were captured
+       for each input or, if by_time is True, the value which was current
+       at the same time since start() in the capture.
+       """
+
+    active = None  ### The StimulusRecorder currently in use, if any
+
+    _MAGIC = b"MBSR"
+    _VERSION = 1
+
+    ### A source definition is _SOURCE_DEF, new id, name length, name.
+    ### A value is source id, microseconds since previous value, count
+    ### then count int32 values with top bit of count signifying a bool
+    ### and the next one a tuple.
+    _SOURCE_DEF = 0xff
+    _VALUE_FMT = "<BIB"
+    _VALUE_LEN = struct.calcsize(_VALUE_FMT)
+    _MAX_DELTA_US = 0xffffffff
+    _BOOL_FLAG = 0x80
+    _TUPLE_FLAG = 0x40
+
+    def __init__(self, file, mode="capture", *, by_time=False):
+        if mode not in ("capture", "replay"):
+            raise ValueError("mode must be capture or replay")
+        self._file = file
+        self._mode = mode
+        self._by_time = by_time
+        self._stream = None
+        self._close_stream = False
+        self._source_ids = {}
+        self._recorded = {}  ### name to [timestamps_us, values, cursor]
+        self._start_ns = 0
+        self._last_ns = 0
+        self.count = 0
+        self.exhausted = 0
+
+
+    @property
+    def replaying(self):
+        return self._mode == "replay"
+
+
+    def start(self):
+        if isinstance(self._file, str):
+            self._stream = open(self._file, "wb" if self._mode == "capture" else "rb")
+            self._close_stream = True
+        else:
+            self._stream = self._file
+
+        if self._mode == "capture":
+            self._stream.write(self._MAGIC + bytes((self._VERSION,)))
+        else:
+            self._load()
+            self._stream = None
+
+        self._start_ns = self._last_ns = time.monotonic_ns()
+        type(self).active = self
+
+
+    def stop(self):
+        if type(self).active is self:
+            type(self).active = None
+        if self._stream is not None and self._close_stream:
+            self._stream.close()
+        self._stream = None
+
+
+    def _load(self):
+        data = self._stream.read()
+        if self._close_stream:
+            self._stream.close()
+        if data[:4] != self._MAGIC or len(data) < 5 or data[4] != self._VERSION:
+            raise ValueError("Not a stimulus capture or unsupported version")
+
+        names = {}
+        idx = 5
+        ts_us = 0
+        while idx < len(data):
+            if data[idx] == self._SOURCE_DEF:
+                name_len = data[idx + 2]
+                name = str(data[idx + 3:idx + 3 + name_len], "utf-8")
+                names[data[idx + 1]] = name
+                self._recorded[name] = [[], [], 0]
+                idx += 3 + name_len
+                continue
+
+            source_id, delta_us, count = struct.unpack_from(self._VALUE_FMT, data, idx)
+            idx += self._VALUE_LEN
+            ts_us += delta_us
+            num = count & ~(self._BOOL_FLAG | self._TUPLE_FLAG)
+            values = struct.unpack_from("<" + str(num) + "i", data, idx)
+            idx += 4 * num
+            if count & self._BOOL_FLAG:
+                value = bool(values[0])
+            else:
+                value = values if count & self._TUPLE_FLAG else values[0]
+            entry = self._recorded[names[source_id]]
+            entry[0].append(ts_us)
+            entry[1].append(value)
+
+
+    def input(self, source, read_fn):
+        """Return the value for the source either by calling read_fn and
+           capturing the result or from the replay data."""
+        if self._mode == "replay":
+            return self._replayValue(source)
+
+        value = read_fn()
+        self._captureValue(source, value)
+        return value
+
+
+    def _captureValue(self, source, value):
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            source_id = len(self._source_ids)
+            if source_id >= self._SOURCE_DEF:
+                raise RuntimeError("Too many input sources")
+            self._source_ids[source] = source_id
+            name = source.encode("utf-8")
+            self._stream.write(bytes((self._SOURCE_DEF, source_id, len(name))) + name)
+
+        now_ns = time.monotonic_ns()
+        delta_us = (now_ns - self._last_ns) // _MICRO_TO_NANO
+        if delta_us > self._MAX_DELTA_US:
+            ### Gaps of over about 71 minutes are recorded as the maximum
+            delta_us = self._MAX_DELTA_US
+            self._last_ns = now_ns
+        else:
+            self._last_ns += delta_us * _MICRO_TO_NANO
+        if isinstance(value, bool):
+            values = (int(value),)
+            count = 1 | self._BOOL_FLAG
+        elif isinstance(value, int):
+            values = (value,)
+            count = 1
+        else:
+            values = value
+            count = len(values) | self._TUPLE_FLAG
+        self._stream.write(struct.pack(self._VALUE_FMT, source_id, delta_us, count)
+                           + struct.pack("<" + str(len(values)) + "i", *values))
+        self.count += 1
+
+
+    def _replayValue(self, source):
+        try:
+            entry = self._recorded[source]
+        except KeyError:
+            raise RuntimeError("No recorded input for " + source)
+        timestamps, values, cursor = entry
+
+        self.count += 1
+        if self._by_time:
+            ### cursor is the current value, the first one is used
+            ### before its timestamp is reached
+            elapsed_us = (time.monotonic_ns() - self._start_ns) // _MICRO_TO_NANO
+            while cursor + 1 < len(timestamps) and timestamps[cursor + 1] <= elapsed_us:
+                cursor += 1
+            entry[2] = cursor
+            return values[cursor]
+
+        ### cursor is the next value, the last one is held when data runs out
+        if cursor < len(values):
+            entry[2] = cursor + 1
+            return values[cursor]
+        self.exhausted += 1
+        return values[-1]
 
 
 ### Class aliases
@@ -2018,13 +4113,22 @@ PinManager.pins.extend([pin5, pin6, pin7, pin8,
                         pin14, pin15, pin16, pin19,
                         pin20])
 
+### This needs to be created before anything adds tasks
+scheduler = backGroundScheduler()
+
 ### The pins will be set to PULL_UP by MicroBitButton
 button_a = MicroBitButton(pin5)
 button_b = MicroBitButton(pin11)
+scheduler.addTask(MicroBitButtonMonitor.pollAll, MicroBitButtonMonitor.POLL_MS)
+
 
+### One bus shared by the sensors, sensor_hub can poll them together
+### if a program registers them with sensor_hub.add()
+_i2c = board.I2C()
+sensor_hub = SensorHub(_i2c)
 
 try:
-    apds9660_sensor = adafruit_apds9960.apds9960.APDS9960(board.I2C())
+    apds9660_sensor = adafruit_apds9960.apds9960.APDS9960(_i2c)
 except NameError:
     apds9660_sensor = None
 
@@ -2036,8 +4140,10 @@ del apds9660_sensor
 
 ### These have some lazy initialisation to stop the instantiation
 ### blowing up if the relevant CircuitPython libraries aren't present in /lib
-accelerometer = MicroBitAccelerometer()
-compass = MicroBitCompass(accel=accelerometer.accel)
+accelerometer = MicroBitAccelerometer(_i2c)
+compass = MicroBitCompass(_i2c, accel=accelerometer)
 
 ### 20k sound system in 5x5mm
 speaker = ClueSpeaker()
+
+note_frequencies = NoteFrequencies()
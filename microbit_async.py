@@ -0,0 +1,124 @@
+### microbit_async.py v0.1
+### asyncio variants of the blocking microbit and music functions
+
+### Needs CircuitPython 7.0.0 or later for async def and the asyncio library,
+### not yet tested on an Adafruit CLUE
+
+### MIT License
+
+### Copyright (c) 2020 Kevin J. Walters
+
+### Permission is hereby granted, free of charge, to any person obtaining a copy
+### of this software and associated documentation files (the "Software"), to deal
+### in the Software without restriction, including without limitation the rights
+### to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+### copies of the Software, and to permit persons to whom the Software is
+### furnished to do so, subject to the following conditions:
+
+### The above copyright notice and this permission notice shall be included in all
+### copies or substantial portions of the Software.
+
+### THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+### IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+### FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+### AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+### LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+### OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+### SOFTWARE.
+
+### This is a separate library as CircuitPython 5.x cannot parse async def
+
+import time
+
+import asyncio
+
+import microbit
+import music
+
+
+_MILLI_TO_NANO = 1000000
+_SEC_TO_NANO = 1000000000
+
+
+async def sleep_until_async(deadline_ns):
+    """As microbit.scheduler.sleepUntil() but yielding to the asyncio
+       event loop, this always yields at least once."""
+    scheduler = microbit.scheduler
+    while True:
+        wait_ns = scheduler.run()
+        remaining_ns = deadline_ns - time.monotonic_ns()
+        if wait_ns is None or wait_ns > remaining_ns:
+            wait_ns = remaining_ns
+        await asyncio.sleep(max(0, wait_ns) / _SEC_TO_NANO)
+        if time.monotonic_ns() >= deadline_ns:
+            break
+
+
+async def sleep_async(num_ms):
+    """As microbit.sleep() but yielding to the asyncio event loop."""
+    await sleep_until_async(time.monotonic_ns() + round(num_ms * _MILLI_TO_NANO))
+
+
+async def _playFrames(frames):
+    """Run a generator of frames which yields the delay in milliseconds
+       after each one, the delays are added to a deadline so any time
+       spent elsewhere in the event loop does not accumulate."""
+    deadline_ns = time.monotonic_ns()
+    for delay in frames:
+        deadline_ns += round(delay * _MILLI_TO_NANO)
+        await sleep_until_async(deadline_ns)
+
+
+async def show_async(value, delay=400, *, loop=False, clear=False, display=None):
+    """As display.show() but yielding to the asyncio event loop between
+       frames, the frames are timed from absolute deadlines."""
+    display = microbit.display if display is None else display
+    await _playFrames(display._showFrames(value, delay,  ### pylint: disable=protected-access
+                                          loop=loop, clear=clear))
+
+
+async def scroll_async(value, delay=150, *, loop=False, monospace=False, display=None):
+    """As display.scroll() but yielding to the asyncio event loop between
+       columns, the columns are timed from absolute deadlines."""
+    display = microbit.display if display is None else display
+    await _playFrames(display._scrollFrames(value, delay,  ### pylint: disable=protected-access
+                                            loop=loop, monospace=monospace))
+
+
+async def _waitFor(players):
+    """As music._waitFor() but yielding to the asyncio event loop, the tunes
+       are stopped if the waiting task is cancelled."""
+    try:
+        while True:
+            music._tick()  ### pylint: disable=protected-access
+            if not any(player.playing for player in players):
+                break
+            await sleep_until_async(min(player.next_ns
+                                        for player in music._players))  ### pylint: disable=protected-access
+    finally:
+        for player in players:
+            if player.playing:
+                player.finish()
+
+
+async def play_parts_async(parts, loop=False):
+    """As music.play_parts() but yielding to the asyncio event loop."""
+    await _waitFor(music._startParts(parts, loop))  ### pylint: disable=protected-access
+
+
+async def play_async(music,  ### pylint: disable=redefined-outer-name
+                     pin=microbit.pin0, loop=False):
+    """As music.play() but yielding to the asyncio event loop at each note step."""
+    await play_parts_async(((music, pin),), loop=loop)
+
+
+async def pitch_async(frequency, duration, pin=microbit.pin0, music_off=True, desc=None):
+    """As music.pitch() with a duration but yielding to the asyncio event loop."""
+    if frequency < 0:
+        raise ValueError("invalid pitch")
+    if duration <= 0:
+        raise ValueError("duration must be positive")
+
+    music._cancel(pin)  ### pylint: disable=protected-access
+    await _waitFor((music._pitchVoice(frequency, duration,  ### pylint: disable=protected-access
+                                      pin, music_off, desc),))
@@ -27,6 +27,8 @@
 ### SOFTWARE.
 
 import time
+import struct
+from array import array
 
 import microbit
 
@@ -43,6 +45,19 @@ _octave = 4
 
 gate_off_time_ms = 10  ### 10ms
 
+_MILLI_TO_NANO = 1000000
+_BUG_WORKAROUND_NS = 8 * _MILLI_TO_NANO
+
+### How late the end of the last tune was and the latest note onset
+### these show if hooks or display updates cannot keep up with the tempo
+tempo_error_ms = 0.0
+max_note_late_ms = 0.0
+
+### Compiled tunes are kept for reuse, least recently used are dropped first
+TUNE_CACHE_SIZE = 8
+_tune_cache = {}
+_tune_cache_order = []
+
 
 ### The microbit music classical selection
 ### from https://github.com/micropython/micropython/blob/264d80c84e034541bd6e4b461bfece4443ffd0ac/ports/nrf/modules/music/musictunes.c  pylint: disable=line-too-long
@@ -96,90 +111,457 @@ def get_tempo():
 ### From C3 - A and B are above G
 ### Semitones   A   B   C   D   E   F   G
 _NOTE_OFFSET = [21, 23, 12, 14, 16, 17, 19]
+_NOTE_NAMES = ("c", "c#", "d", "d#", "e", "f", "f#", "g", "g#", "a", "a#", "b")
+
+_REST = microbit.NoteFrequencies.REST
+_MAX_TICKS = 65535
+_MAX_NOTE = 127  ### highest MIDI note in microbit.NoteFrequencies, g9
+
 
-_MIDI_A4 = 69
-_FREQ_A4 = 440.0
+def _noteName(midi_note, ticks):
+    if midi_note == _REST:
+        return "r:" + str(ticks)
+    return _NOTE_NAMES[midi_note % 12] + str(midi_note // 12 - 1) + ":" + str(ticks)
 
 
-def _parseNote(note):
-    """Converts the string encoded note form into frequency and duration in milliseconds.
-       A rest is returned as note_freq of 0.
+def _parseNote(note, octave, duration):
+    """Parse one note returning a tuple of the MIDI note number (0 for a rest),
+       the octave and duration in ticks which carry on to the next note
+       and None or the index of the first bad character, this is the
+       octave for notes above g9 which are past the end of the MIDI range.
        """
+    length = len(note)
+    char_uc = note[0].upper() if length else ""
+    if char_uc == "R":
+        semitone = None  ### signifies a rest
+    elif "A" <= char_uc <= "G":
+        semitone = _NOTE_OFFSET[ord(char_uc) - 65]  ### 65 is ord("A")
+    else:
+        return (_REST, octave, duration, 0)
 
-    if not isinstance(note, str):
-        raise ValueError("Bad note format")
+    ### Optional #/b, then octave, then :tickduration
+    idx = 1
+    octave_idx = 0
+    if idx < length and note[idx] in "#b":
+        if semitone is not None:
+            semitone += 1 if note[idx] == "#" else -1
+        idx += 1
 
-    idx = 0
-    try:
-        char_uc = note[idx].upper()
-        if char_uc == "R":
-            note_st = None  ### signifies a rest
-        else:
-            note_st = _NOTE_OFFSET[ord(char_uc) - 65]  ### 65 is ord("A")
+    if idx < length and "0" <= note[idx] <= "9":
+        octave_idx = idx
+        octave = ord(note[idx]) - 48  ### 48 is ord("0")
         idx += 1
-    except IndexError:
-        raise ValueError("Bad note format")
 
-    sharpen = 0
-    note_oct = _octave
-    note__ticks = _ticks
+    if idx < length and note[idx] == ":":
+        idx += 1
+        digits_start = idx
+        while idx < length and "0" <= note[idx] <= "9":
+            idx += 1
+        if idx == digits_start:
+            return (_REST, octave, duration, idx)
+        duration = int(note[digits_start:idx])
+        if duration > _MAX_TICKS:
+            return (_REST, octave, duration, digits_start)
 
-    ### Optional #/b, then octave, then :tickduration
-    try:
-        if note[idx] == "#":
-            sharpen = 1
+    if idx != length:
+        return (_REST, octave, duration, idx)
+
+    midi_note = _REST if semitone is None else octave * 12 + semitone
+    if midi_note > _MAX_NOTE:
+        return (_REST, octave, duration, octave_idx)
+    return (midi_note, octave, duration, None)
+
+
+def _splitTune(text):
+    """Yields the position and text of each whitespace separated note."""
+    idx = 0
+    length = len(text)
+    while idx < length:
+        if text[idx] in " \t\r\n":
             idx += 1
-        elif note[idx] == "b":
-            sharpen = -1
+            continue
+        start = idx
+        while idx < length and text[idx] not in " \t\r\n":
             idx += 1
+        yield (start, text[start:idx])
 
-        if "0" <= note[idx] <= "9":
-            note_oct = int(note[idx])
-            idx += 1
 
-        if note[idx] == ":":
-            idx += 1
+class Tune:
+    """A compiled tune which can be played many times and saved with
+       to_bytes(). The notes are MIDI note numbers with 0 for a rest
+       and the durations are in ticks so a Tune does not depend on the tempo.
+       octave and duration are what the last note leaves for the next one.
+       """
+    MAGIC = b"MBTN"
+    VERSION = 1
+    _HEADER_FMT = "<4sBBHH"
+    _NOTE_FMT = "<BH"
+
+    def __init__(self, notes, ticks, *, names=None, octave=4, duration=4):
+        self.notes = notes
+        self.ticks = ticks
+        if names is None:
+            names = tuple(_noteName(notes[idx], ticks[idx]) for idx in range(len(notes)))
+        self.names = names
+        self.octave = octave
+        self.duration = duration
+
+
+    def __len__(self):
+        return len(self.notes)
+
+
+    def to_bytes(self):
+        header_len = struct.calcsize(self._HEADER_FMT)
+        note_len = struct.calcsize(self._NOTE_FMT)
+        data = bytearray(header_len + note_len * len(self.notes))
+        struct.pack_into(self._HEADER_FMT, data, 0,
+                         self.MAGIC, self.VERSION,
+                         self.octave, self.duration, len(self.notes))
+        offset = header_len
+        for idx in range(len(self.notes)):
+            struct.pack_into(self._NOTE_FMT, data, offset,
+                             self.notes[idx], self.ticks[idx])
+            offset += note_len
+        return bytes(data)
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        header_len = struct.calcsize(cls._HEADER_FMT)
+        note_len = struct.calcsize(cls._NOTE_FMT)
+        if len(data) < header_len:
+            raise ValueError("not a compiled tune")
+        (magic, version,
+         octave, duration, count) = struct.unpack_from(cls._HEADER_FMT, data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a compiled tune")
+        if len(data) != header_len + note_len * count:
+            raise ValueError("compiled tune is truncated")
+
+        notes = array("B", [0] * count)
+        ticks = array("H", [0] * count)
+        offset = header_len
+        for idx in range(count):
+            notes[idx], ticks[idx] = struct.unpack_from(cls._NOTE_FMT, data, offset)
+            offset += note_len
+        return cls(notes, ticks, octave=octave, duration=duration)
+
+
+def compile_tune(music, octave=None, duration=None):
+    """Compile a tune string or list of notes into a Tune.
+       The octave and duration start from the values left by the last tune
+       played unless they are specified.
+       A ValueError gives the position of any bad note.
+       """
+    octave = _octave if octave is None else octave
+    duration = _duration if duration is None else duration
+
+    if isinstance(music, str):
+        tokens = _splitTune(music)
+    else:
+        tokens = enumerate(music)
+
+    names = []
+    notes = array("B")
+    ticks = array("H")
+    for pos, note in tokens:
+        if not isinstance(note, str):
+            raise ValueError("Bad note format at note " + str(pos))
+        midi_note, octave, duration, bad_idx = _parseNote(note, octave, duration)
+        if bad_idx is not None:
+            if isinstance(music, str):
+                where = "character " + str(pos + bad_idx)
+            else:
+                where = "note " + str(pos) + " character " + str(bad_idx)
+            raise ValueError("Bad note format " + repr(note) + " at " + where)
+        names.append(note)
+        notes.append(midi_note)
+        ticks.append(duration)
 
-        note__ticks = int(note[idx:])
+    return Tune(notes, ticks, names=tuple(names), octave=octave, duration=duration)
 
-    except (IndexError, ValueError):
+
+def _compileTune(music):
+    """Returns a Tune for music, these are cached as they depend only
+       on the tune and the octave and duration left by the last tune.
+       """
+    if isinstance(music, Tune):
+        return music
+
+    ### A string is its own key so it only needs splitting when compiled
+    source = music if isinstance(music, str) else tuple(music)
+    key = (source, _octave, _duration)
+    try:
+        tune = _tune_cache[key]
+        _tune_cache_order.remove(key)
+        _tune_cache_order.append(key)
+        return tune
+    except KeyError:
         pass
 
-    ### Convert to a frequency using A4 as the reference
-    ### and counting semitones as MIDI note numbers
-    if note_st is None:
-        note_freq = 0
-    else:
-        ### 12 semitones in an octave
-        note_freq = _FREQ_A4 * 2 ** (note_oct + (note_st + sharpen - _MIDI_A4) / 12.0)
+    tune = compile_tune(source)
+    if len(_tune_cache_order) >= TUNE_CACHE_SIZE:
+        del _tune_cache[_tune_cache_order.pop(0)]
+    _tune_cache[key] = tune
+    _tune_cache_order.append(key)
+    return tune
 
-    ### _bpm and _ticks are globals here, first number is ms in a minute
-    note_dur = 60000 * note__ticks / _bpm / _ticks
 
-    return (note_freq, note_dur)
+### The steps of playing one note
+_PHASE_ONSET = 0
+_PHASE_RESEND = 1
+_PHASE_GATE = 2
+_PHASE_END = 3
 
 
-def play(music, pin=microbit.pin0, wait=True, loop=False):
-    if not wait:
-        raise NotImplementedError("non-blocking play not implemented")
+class _TunePlayer:
+    """Plays a compiled tune as a sequence of absolute deadlines,
+       step() does whatever is due and next_ns is when to call it again.
+       Every onset and gate off is an absolute deadline so time spent
+       in hooks and display updates comes out of the gate rather than
+       accumulating over the tune.
+       """
 
-    if isinstance(music, str):
-        ### Could check for tabs here...
-        notes = music.split() if " " in music else (music,)
+    def __init__(self, pin, names, notes, ticks, *, frequencies=None, start_ns=None,
+                 ms_per_tick=1.0, loop=False, gate_ms=0, music_off=True):
+        """notes index frequencies which defaults to the table
+           from microbit.note_frequencies.
+           """
+        self.pin = pin
+        self._names = names
+        self._notes = notes
+        self._frequencies = (microbit.note_frequencies.table
+                             if frequencies is None else frequencies)
+        self._ticks = ticks
+        self._ms_per_tick = ms_per_tick
+        self._loop = loop
+        self._gate_ns = round(gate_ms * _MILLI_TO_NANO)
+        self._music_off = music_off
+
+        self._idx = 0
+        self._phase = _PHASE_ONSET
+        self._onset_ns = time.monotonic_ns() if start_ns is None else start_ns
+        self._end_ns = self._onset_ns
+        self.next_ns = self._onset_ns
+        self._max_late_ns = 0
+        self.playing = True
+
+
+    def step(self):
+        """Carry out all the steps which are due, returns False once the tune has finished."""
+        while self.playing and time.monotonic_ns() >= self.next_ns:
+            self._advance()
+        return self.playing
+
+
+    def _soundEndNs(self):
+        """When the note goes silent, this is before the end if there is a gate."""
+        if self._end_ns - self._onset_ns > self._gate_ns:
+            return self._end_ns - self._gate_ns
+        return self._end_ns
+
+
+    def _afterOnset(self):
+        if self._soundEndNs() < self._end_ns:
+            self._phase = _PHASE_GATE
+            self.next_ns = self._soundEndNs()
+        else:
+            self._phase = _PHASE_END
+            self.next_ns = self._end_ns
+
+
+    def _advance(self):
+        global tempo_error_ms, max_note_late_ms  ### pylint: disable=global-statement
+
+        pin = self.pin
+        idx = self._idx
+        if self._phase == _PHASE_ONSET:
+            late_ns = time.monotonic_ns() - self._onset_ns
+            if late_ns > self._max_late_ns:
+                self._max_late_ns = late_ns
+            self._end_ns = self._onset_ns + round(self._ticks[idx] * self._ms_per_tick
+                                                  * _MILLI_TO_NANO)
+            pin.music_on()
+            pin.music_frequency(self._frequencies[self._notes[idx]],
+                                desc=self._names[idx])
+            resend_ns = self._onset_ns + _BUG_WORKAROUND_NS
+            if BUG_WORKAROUND and resend_ns < self._soundEndNs():
+                ### This is within the note's time, not added to it
+                self._phase = _PHASE_RESEND
+                self.next_ns = resend_ns
+            else:
+                self._afterOnset()
+
+        elif self._phase == _PHASE_RESEND:
+            pin.music_frequency(self._frequencies[self._notes[idx]],
+                                desc=self._names[idx])
+            self._afterOnset()
+
+        elif self._phase == _PHASE_GATE:
+            pin.music_frequency(0)
+            self._phase = _PHASE_END
+            self.next_ns = self._end_ns
+
+        else:
+            self._onset_ns = self._end_ns
+            self._idx += 1
+            if self._idx >= len(self._names):
+                tempo_error_ms = (time.monotonic_ns() - self._end_ns) / _MILLI_TO_NANO
+                max_note_late_ms = self._max_late_ns / _MILLI_TO_NANO
+                if self._loop:
+                    self._idx = 0
+                else:
+                    self.finish()
+                    return
+            self._phase = _PHASE_ONSET
+            self.next_ns = self._onset_ns
+
+
+    def restart(self, start_ns):
+        """Move the first onset to start_ns, this lines up parts
+           which have been set up one after another."""
+        self._idx = 0
+        self._phase = _PHASE_ONSET
+        self._onset_ns = start_ns
+        self._end_ns = start_ns
+        self.next_ns = start_ns
+
+
+    def finish(self):
+        self.playing = False
+        self.pin.music_frequency(0)
+        if self._music_off:
+            self.pin.music_off()
+
+
+### Every tune playing is a voice, they all share one scheduler task
+### The oldest voice is stolen if there are too many or no PWM timers are free
+MUSIC_TICK_MS = 1
+MAX_VOICES = 4
+voices_stolen = 0
+timers_exhausted = 0
+_players = []
+_task = None
+
+
+def _steal():
+    global voices_stolen  ### pylint: disable=global-statement
+
+    victim = _players.pop(0)
+    if victim.playing:
+        victim.finish()
+        voices_stolen += 1
+
+
+def _startVoice(player):
+    global _task, timers_exhausted  ### pylint: disable=global-statement
+
+    _cancel(player.pin, tick=False)
+    while len(_players) >= MAX_VOICES:
+        _steal()
+
+    ### Music mode needs a variable frequency PWM timer (or the speaker)
+    ### and the nRF52840 only has a few of those
+    while True:
+        try:
+            player.pin.music_on()
+            break
+        except (RuntimeError, ValueError):
+            timers_exhausted += 1
+            if not _players:
+                raise
+            _steal()
+
+    _players.append(player)
+    if _task is None:
+        _task = _tick
+        microbit.scheduler.addTask(_task, MUSIC_TICK_MS)
+
+
+def _tick():
+    global _task  ### pylint: disable=global-statement
+
+    for player in _players:
+        try:
+            player.step()
+        except Exception:
+            ### Drop the voice so it does not raise on every tick
+            _players.remove(player)
+            try:
+                player.finish()
+            except Exception:  ### pylint: disable=broad-except
+                player.playing = False
+            raise
+    if any(not player.playing for player in _players):
+        _players[:] = [player for player in _players if player.playing]
+    if not _players and _task is not None:
+        microbit.scheduler.removeTask(_task)
+        _task = None
+
+
+def _cancel(pin, tick=True):
+    """Stop any tune on pin without touching the pin, with tick False
+       the other voices are not stepped, this is used while starting a group."""
+    for player in _players:
+        if player.pin is pin:
+            player.playing = False
+    if tick:
+        _tick()
     else:
-        notes = music
+        _players[:] = [player for player in _players if player.playing]
+
 
+def _waitFor(players):
+    """Wait for players to finish while running every voice."""
     while True:
-        for note in notes:
-            freq, dur_ms = _parseNote(note)
-            if dur_ms > gate_off_time_ms:
-                pitch(freq, dur_ms - gate_off_time_ms, pin=pin, music_off=False, desc=note)
-                time.sleep(gate_off_time_ms / 1000.0)
-            else:
-                pitch(freq, dur_ms, pin=pin, music_off=False, desc=note)
-        if not loop:
+        _tick()
+        if not any(player.playing for player in players):
             break
-    stop(pin)
+        microbit.scheduler.sleepUntil(min(player.next_ns for player in _players))
+
+
+def _startParts(parts, loop):
+    global _octave, _duration  ### pylint: disable=global-statement
+
+    ### Any bad notes are found here before anything plays and
+    ### every part starts with the same octave and duration
+    tunes = [(_compileTune(music), pin) for music, pin in parts]
+    if not tunes:
+        return []
+    _octave = tunes[-1][0].octave
+    _duration = tunes[-1][0].duration
+
+    ### _bpm and _ticks are globals here, first number is ms in a minute
+    ms_per_tick = 60000 / _bpm / _ticks
+    players = []
+    for tune, pin in tunes:
+        player = _TunePlayer(pin, tune.names, tune.notes, tune.ticks,
+                             ms_per_tick=ms_per_tick,
+                             loop=loop, gate_ms=gate_off_time_ms)
+        _startVoice(player)
+        players.append(player)
+
+    start_ns = time.monotonic_ns()
+    for player in players:
+        player.restart(start_ns)
+    return players
+
+
+def play_parts(parts, wait=True, loop=False):
+    """Play several tunes at once, parts is a sequence of (music, pin) pairs.
+       Every part starts on the same deadline, each needs its own pin.
+       """
+    players = _startParts(parts, loop)
+    if wait:
+        _waitFor(players)
+
+
+def play(music, pin=microbit.pin0, wait=True, loop=False):
+    """Play music which is a tune string, a list of notes or a Tune,
+       the octave and duration of the last note carry on to the next tune.
+       """
+    play_parts(((music, pin),), wait=wait, loop=loop)
 
 
 def pitch(frequency, duration=-1, pin=microbit.pin0, wait=True, music_off=True, desc=None):
@@ -188,30 +570,43 @@ def pitch(frequency, duration=-1, pin=microbit.pin0, wait=True, music_off=True,
        A frequency of 0 can be used to silence the output
        but leave pin in music mode.
        """
-    if not wait and duration > 0:
-        raise NotImplementedError("non-blocking pitch not implemented")
-
     if frequency < 0:
         raise ValueError("invalid pitch")
 
-    pin.music_on()
-    pin.music_frequency(frequency, desc=desc)
-    if BUG_WORKAROUND:
-        time.sleep(0.008)
+    _cancel(pin)
+    if duration > 0:
+        player = _pitchVoice(frequency, duration, pin, music_off, desc)
+        if wait:
+            _waitFor((player,))
+    else:
+        pin.music_on()
         pin.music_frequency(frequency, desc=desc)
+        if BUG_WORKAROUND:
+            microbit.scheduler.sleep(_BUG_WORKAROUND_NS / _MILLI_TO_NANO)
+            pin.music_frequency(frequency, desc=desc)
+
 
-    if wait and duration > 0:
-        time.sleep(duration / 1000.0)
-        stop(pin, music_off=music_off)
+def _pitchVoice(frequency, duration, pin, music_off, desc):
+    player = _TunePlayer(pin, (desc,), (0,), (duration,),
+                         frequencies=(frequency,), music_off=music_off)
+    _startVoice(player)
+    return player
 
 
 def stop(pin=microbit.pin0, music_off=True):
-    """Silence the music output on the pin and turn off music mode."""
+    """Silence the music output on the pin, stopping any tune playing on it,
+       and turn off music mode."""
+    _cancel(pin)
     pin.music_frequency(0)
     if music_off:
         pin.music_off()
 
 
+def is_playing():
+    """True if any tune or timed pitch is playing."""
+    return any(player.playing for player in _players)
+
+
 def reset():
     global _ticks, _bpm, _duration, _octave  ### pylint: disable=global-statement
 
@@ -224,4 +619,99 @@ def reset():
 ### Extras
 
 def update():
-    pass
+    """Advance any background music, this can be called
+       by programs with busy loops which do not use sleep()."""
+    _tick()
+
+
+_WAV_HEADER_FMT = "<4sI4s4sIHHIIHH4sI"
+_RENDER_TABLE_LEN = 256
+
+
+def _renderSetup(music):
+    """Compile music and move on the octave and duration state as play() would."""
+    global _octave, _duration  ### pylint: disable=global-statement
+
+    tune = _compileTune(music)
+    _octave = tune.octave
+    _duration = tune.duration
+    ### _bpm and _ticks are globals here, first number is ms in a minute
+    return (tune, 60000 / _bpm / _ticks)
+
+
+def _renderFrames(tune, ms_per_tick, sample_rate):
+    return round(sum(tune.ticks) * ms_per_tick * sample_rate / 1000)
+
+
+def _renderChunks(tune, ms_per_tick, *, sample_rate, waveform, volume, chunk_frames):
+    table = microbit.ClueSpeaker._table(waveform, _RENDER_TABLE_LEN)  ### pylint: disable=protected-access
+    volume = max(0.0, min(volume, 1.0))  ### more would overflow the samples
+    wave = array("h", [round((value - 32768) * volume) for value in table])
+    frequencies = microbit.note_frequencies.table
+    chunk = array("h", [0] * chunk_frames)
+    fill = 0
+    frame = 0
+    end_ticks = 0
+    for idx in range(len(tune)):
+        ### Note boundaries come from the total ticks so rounding never accumulates
+        end_ticks += tune.ticks[idx]
+        end_ms = end_ticks * ms_per_tick
+        dur_ms = tune.ticks[idx] * ms_per_tick
+        sound_end_ms = end_ms - gate_off_time_ms if dur_ms > gate_off_time_ms else end_ms
+        end_frame = round(end_ms * sample_rate / 1000)
+        sound_end_frame = round(sound_end_ms * sample_rate / 1000)
+
+        frequency = frequencies[tune.notes[idx]]
+        step = frequency * _RENDER_TABLE_LEN / sample_rate
+        pos = 0.0
+        while frame < end_frame:
+            if frame < sound_end_frame and frequency > 0:
+                chunk[fill] = wave[int(pos) % _RENDER_TABLE_LEN]
+                pos += step
+            else:
+                chunk[fill] = 0
+            fill += 1
+            frame += 1
+            if fill == chunk_frames:
+                yield chunk
+                fill = 0
+    if fill:
+        yield chunk[:fill]
+
+
+def render(music, *, sample_rate=16000, waveform="square", volume=0.5, chunk_frames=1024):
+    """Render music to signed 16 bit mono PCM using the same tempo and gate off
+       as play(), this yields arrays of up to chunk_frames samples.
+       The same array is reused for each chunk. volume is clamped to 0.0 to 1.0.
+       """
+    tune, ms_per_tick = _renderSetup(music)
+    return _renderChunks(tune, ms_per_tick, sample_rate=sample_rate, waveform=waveform,
+                         volume=volume, chunk_frames=chunk_frames)
+
+
+def render_wav(music, file, *, sample_rate=16000, waveform="square",
+               volume=0.5, chunk_frames=1024):
+    """Render music to a WAV file to a filename or a binary stream,
+       returns the number of frames written.
+       The default square wave is what a pin with a piezo would play,
+       volume is clamped to 0.0 to 1.0.
+       """
+    if isinstance(file, str):
+        with open(file, "wb") as stream:
+            return render_wav(music, stream, sample_rate=sample_rate, waveform=waveform,
+                              volume=volume, chunk_frames=chunk_frames)
+
+    tune, ms_per_tick = _renderSetup(music)
+    frames = _renderFrames(tune, ms_per_tick, sample_rate)
+    data_len = frames * 2
+    file.write(struct.pack(_WAV_HEADER_FMT,
+                           b"RIFF", 36 + data_len, b"WAVE",
+                           b"fmt ", 16, 1, 1,  ### PCM, mono
+                           sample_rate, sample_rate * 2, 2, 16,
+                           b"data", data_len))
+    ### array is native byte order which is little endian on the
+    ### nRF52840 and the usual hosts as WAV requires
+    for chunk in _renderChunks(tune, ms_per_tick, sample_rate=sample_rate, waveform=waveform,
+                               volume=volume, chunk_frames=chunk_frames):
+        file.write(chunk)
+    return frames
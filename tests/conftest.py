@@ -0,0 +1,127 @@
+### Host test setup, these are stand-ins for the CircuitPython modules
+### microbit imports so the pure Python parts can be checked off a board.
+### The sensor libraries like adafruit_lsm6ds are left out as microbit
+### copes with those being missing, the display ones are needed.
+
+import os
+import sys
+import types
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    for attr_name, value in attrs.items():
+        setattr(module, attr_name, value)
+    sys.modules[name] = module
+    return module
+
+
+class _Stub:
+    """Accepts any arguments and has a value attribute."""
+    def __init__(self, *args, **kwargs):
+        self.value = False
+        self.raw_value = 0
+        self.pull = None
+        self.playing = False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _Group(list):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.x = 0
+        self.y = 0
+
+
+class _Bitmap:
+    def __init__(self, width, height=1, _colours=None):
+        self._data = [0] * (width * height)
+
+    def __setitem__(self, idx, value):
+        self._data[idx] = value
+
+
+class _PulseIn(_Stub):
+    def __init__(self, *args, maxlen=2, **kwargs):
+        super().__init__()
+        self.maxlen = maxlen
+        self._pulses = []
+
+    def __len__(self):
+        return len(self._pulses)
+
+    def __getitem__(self, idx):
+        return self._pulses[idx]
+
+    def popleft(self):
+        return self._pulses.pop(0)
+
+    def clear(self):
+        self._pulses = []
+
+
+class _PWMAudioOut(_Stub):
+    def play(self, _sample, loop=False):
+        self.playing = True
+
+    def stop(self):
+        self.playing = False
+
+    def deinit(self):
+        self.playing = False
+
+
+class _RawSample:
+    def __init__(self, buffer, sample_rate=8000, channel_count=1):
+        self.buffer = buffer
+        self.sample_rate = sample_rate
+
+
+class _Label(_Stub):
+    def __init__(self, text="", **kwargs):
+        super().__init__()
+        self.text = text
+        self.x = 0
+        self.y = 0
+
+
+class _DisplayPin(_Stub):
+    def __init__(self, *args, value=None, **kwargs):
+        super().__init__()
+        self.group = _Group()
+        self.value = value
+
+
+class _Display:
+    width = 240
+    height = 240
+    auto_refresh = True
+
+    def show(self, _group):
+        pass
+
+
+if "board" not in sys.modules:
+    _module("board", DISPLAY=_Display(), I2C=lambda: None,
+            **{name: name for name in ["P" + str(idx) for idx in range(21)]
+               + ["SPEAKER"]})
+    _module("supervisor", reload=lambda: None)
+    _module("displayio", Bitmap=_Bitmap, Palette=_Bitmap, TileGrid=_Stub, Group=_Group)
+    _module("terminalio", FONT=None)
+    _module("analogio", AnalogIn=_Stub)
+    _module("digitalio", DigitalInOut=_Stub,
+            Pull=types.SimpleNamespace(UP=1, DOWN=2))
+    _module("touchio", TouchIn=_Stub)
+    _module("pulseio", PWMOut=_Stub, PulseIn=_PulseIn)
+    _module("gamepad", GamePad=type("GamePad", (_Stub,), {"get_pressed": lambda self: 0}))
+    _module("audiopwmio", PWMAudioOut=_PWMAudioOut)
+    _module("audiocore", RawSample=_RawSample)
+    _module("adafruit_display_text")
+    sys.modules["adafruit_display_text"].label = _module("adafruit_display_text.label",
+                                                         Label=_Label)
+    _module("display_pin", DisplayPin=_DisplayPin)
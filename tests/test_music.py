@@ -0,0 +1,56 @@
+import pytest
+
+import music
+
+
+def test_compile_carries_octave_and_duration():
+    tune = music.compile_tune("c4:4 d e5:2 r b3", octave=4, duration=4)
+    assert list(tune.notes) == [60, 62, 76, 0, 59]
+    assert list(tune.ticks) == [4, 4, 2, 2, 2]
+    assert tune.names == ("c4:4", "d", "e5:2", "r", "b3")
+    assert (tune.octave, tune.duration) == (3, 2)
+
+
+def test_compile_sharps_flats_and_lists():
+    tune = music.compile_tune(["c#4", "Eb", "a0", "g9"], octave=4, duration=4)
+    assert list(tune.notes) == [61, 63, 21, 127]
+
+
+@pytest.mark.parametrize("music_in, where", [
+    ("c4 x d", "character 3"),
+    ("c4 d:", "character 5"),
+    ("c4 d:70000", "character 5"),
+    ("g#9", "character 2"),
+    (["c", "a9"], "note 1 character 1"),
+])
+def test_compile_reports_bad_notes(music_in, where):
+    with pytest.raises(ValueError) as excinfo:
+        music.compile_tune(music_in, octave=4, duration=4)
+    assert str(excinfo.value).endswith(where)
+
+
+def test_tune_round_trip():
+    tune = music.compile_tune("c4:4 r:1 g5:16 f#2", octave=4, duration=4)
+    data = tune.to_bytes()
+    copy = music.Tune.from_bytes(data)
+    assert list(copy.notes) == list(tune.notes)
+    assert list(copy.ticks) == list(tune.ticks)
+    assert (copy.octave, copy.duration) == (tune.octave, tune.duration)
+    assert copy.to_bytes() == data
+
+
+def test_tune_from_bad_bytes():
+    data = music.compile_tune("c d e", octave=4, duration=4).to_bytes()
+    with pytest.raises(ValueError):
+        music.Tune.from_bytes(data[:-1])
+    with pytest.raises(ValueError):
+        music.Tune.from_bytes(b"XXXX" + data[4:])
+
+
+def test_builtin_tunes_compile():
+    names = [name for name in dir(music)
+             if name.isupper() and not name.startswith("_")
+             and isinstance(getattr(music, name), str)]
+    assert "BIRTHDAY" in names
+    for name in names:
+        assert len(music.compile_tune(getattr(music, name), octave=4, duration=4)) > 0
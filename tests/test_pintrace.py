@@ -0,0 +1,57 @@
+import io
+
+import microbit
+
+
+def test_events_from_pin_hooks():
+    recorder = microbit.PinTraceRecorder(capacity=16)
+    recorder.start()
+    microbit.pin8.write_digital(1)
+    microbit.pin8.write_digital(0)
+    recorder.stop()
+    microbit.pin8.write_digital(1)  ### not recorded after stop()
+
+    events = list(recorder.events())
+    assert [(name, op, value) for _, name, op, value in events] == [
+        ("P8", "write_digital", 1), ("P8", "write_digital", 0)]
+    assert events[0][0] <= events[1][0]
+
+
+def test_stop_leaves_other_recorders_hooks():
+    first = microbit.PinTraceRecorder(capacity=16)
+    second = microbit.PinTraceRecorder(capacity=16)
+    first.start()
+    second.start()
+    first.stop()
+    microbit.pin8.write_digital(1)
+    second.stop()
+    assert len(first) == 0
+    assert len(second) == 1
+
+
+def test_ring_overwrites_oldest():
+    recorder = microbit.PinTraceRecorder(capacity=2)
+    for value in (1, 2, 3):
+        recorder.record(None, 2, value)
+    assert len(recorder) == 2
+    assert recorder.overwritten == 1
+    assert [event[3] for event in recorder.events()] == [2, 3]
+
+
+def test_vcd_output():
+    recorder = microbit.PinTraceRecorder(capacity=8)
+    recorder.start()
+    microbit.pin0.write_digital(1)
+    microbit.pin0.write_analog(5)
+    recorder.stop()
+
+    stream = io.StringIO()
+    recorder.writeVCD(stream)
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "$timescale 1ns $end"
+    assert "$var wire 1 ! P0_digital $end" in lines
+    assert '$var integer 32 " P0_analog $end' in lines
+    assert "$enddefinitions $end" in lines
+    assert lines[lines.index("$dumpvars") + 1:lines.index("$dumpvars") + 3] == ["x!", 'bx "']
+    assert "1!" in lines
+    assert lines[-1] == 'b101 "'
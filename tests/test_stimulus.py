@@ -0,0 +1,73 @@
+import io
+
+import pytest
+
+import microbit
+
+
+def _capture(inputs):
+    stream = io.BytesIO()
+    recorder = microbit.StimulusRecorder(stream)
+    recorder.start()
+    for source, value in inputs:
+        assert recorder.input(source, lambda value=value: value) == value
+    recorder.stop()
+    return stream.getvalue()
+
+
+def test_capture_and_replay_in_order():
+    inputs = [("pin0.read_digital", 1), ("accelerometer", (10, -20, 1000)),
+              ("pin0.read_digital", 0), ("button_a", True), ("one", (7,))]
+    data = _capture(inputs)
+
+    replay = microbit.StimulusRecorder(io.BytesIO(data), "replay")
+    replay.start()
+    for source, value in inputs:
+        assert replay.input(source, lambda: pytest.fail("read in replay")) == value
+    assert replay.exhausted == 0
+    ### The last value is held when the capture runs out
+    assert replay.input("pin0.read_digital", None) == 0
+    assert replay.exhausted == 1
+    replay.stop()
+
+
+def test_active_only_while_started():
+    recorder = microbit.StimulusRecorder(io.BytesIO())
+    assert microbit.StimulusRecorder.active is None
+    recorder.start()
+    assert microbit.StimulusRecorder.active is recorder
+    recorder.stop()
+    assert microbit.StimulusRecorder.active is None
+
+
+def test_replay_unknown_source():
+    replay = microbit.StimulusRecorder(io.BytesIO(_capture([("a", 1)])), "replay")
+    replay.start()
+    with pytest.raises(RuntimeError):
+        replay.input("b", None)
+    replay.stop()
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        microbit.StimulusRecorder(io.BytesIO(b"RIFF\x01"), "replay").start()
+    with pytest.raises(ValueError):
+        microbit.StimulusRecorder(io.BytesIO(b"MBSR\x09"), "replay").start()
+    with pytest.raises(ValueError):
+        microbit.StimulusRecorder(io.BytesIO(), "bogus")
+
+
+def test_long_gap_is_clamped(monkeypatch):
+    now_ns = [0]
+    monkeypatch.setattr(microbit.time, "monotonic_ns", lambda: now_ns[0])
+    stream = io.BytesIO()
+    recorder = microbit.StimulusRecorder(stream)
+    recorder.start()
+    now_ns[0] = 5 * 3600 * 1000000000  ### well past 32 bits of microseconds
+    recorder.input("a", lambda: 1)
+    recorder.stop()
+
+    replay = microbit.StimulusRecorder(io.BytesIO(stream.getvalue()), "replay")
+    replay.start()
+    assert replay.input("a", None) == 1
+    replay.stop()
@@ -0,0 +1,46 @@
+import pytest
+
+import utime
+
+
+@pytest.fixture
+def clock():
+    clock = utime.VirtualClock()
+    utime.set_time_source(clock)
+    yield clock
+    utime.set_time_source()
+
+
+def test_ticks_diff_across_wraparound():
+    near_end = utime.TICKS_MAX - 5
+    later = utime.ticks_add(near_end, 10)
+    assert later == 4
+    assert utime.ticks_diff(later, near_end) == 10
+    assert utime.ticks_diff(near_end, later) == -10
+
+
+def test_ticks_diff_half_period():
+    half = utime.TICKS_PERIOD // 2
+    assert utime.ticks_diff(half - 1, 0) == half - 1
+    assert utime.ticks_diff(half, 0) == -half
+    assert utime.ticks_add(0, -1) == utime.TICKS_MAX
+
+
+def test_ticks_wrap_with_virtual_clock(clock):
+    clock.advance((utime.TICKS_PERIOD - 3) * 1000000)
+    start = utime.ticks_ms()
+    assert start == utime.TICKS_PERIOD - 3
+    utime.sleep_ms(7)
+    assert utime.ticks_ms() == 4
+    assert utime.ticks_diff(utime.ticks_ms(), start) == 7
+
+
+def test_sleep_until_fixed_rate(clock):
+    deadline = utime.ticks_ms()
+    for _ in range(3):
+        deadline = utime.ticks_add(deadline, 20)
+        clock.advance(5 * 1000000)  ### work in the loop
+        assert utime.sleep_until(deadline) == 0
+        assert utime.ticks_ms() == deadline
+    clock.advance(30 * 1000000)
+    assert utime.sleep_until(utime.ticks_add(deadline, 20)) == 10
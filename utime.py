@@ -0,0 +1,126 @@
+### utime.py v0.1
+### An emulation of the MicroPython micro:bit utime library
+
+### Written for an Adafruit CLUE and CircuitPython 5.3.1, not yet tested on one
+
+### MIT License
+
+### Copyright (c) 2020 Kevin J. Walters
+
+### Permission is hereby granted, free of charge, to any person obtaining a copy
+### of this software and associated documentation files (the "Software"), to deal
+### in the Software without restriction, including without limitation the rights
+### to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+### copies of the Software, and to permit persons to whom the Software is
+### furnished to do so, subject to the following conditions:
+
+### The above copyright notice and this permission notice shall be included in all
+### copies or substantial portions of the Software.
+
+### THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+### IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+### FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+### AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+### LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+### OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+### SOFTWARE.
+
+import time
+
+import microbit
+
+
+### Ticks wrap like MicroPython's which keeps them as small ints
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = TICKS_PERIOD >> 1
+
+_MICRO_TO_NANO = 1000
+_MILLI_TO_NANO = 1000000
+_SEC_TO_NANO = 1000000000
+
+
+class VirtualClock:
+    """A time source for tests and simulations which only moves
+       when advanced, sleeping on it advances it instantly."""
+
+    def __init__(self, start_ns=0):
+        self.now_ns = start_ns
+
+
+    def __call__(self):
+        return self.now_ns
+
+
+    def advance(self, num_ns):
+        self.now_ns += num_ns
+
+
+_time_source = time.monotonic_ns
+_clock = None
+
+
+def set_time_source(source=None):
+    """Use source, a function returning nanoseconds, for ticks.
+       A VirtualClock also takes over sleeping, None restores the real time."""
+    global _time_source, _clock  ### pylint: disable=global-statement
+
+    _time_source = time.monotonic_ns if source is None else source
+    _clock = source if isinstance(source, VirtualClock) else None
+
+
+def ticks_ms():
+    return (_time_source() // _MILLI_TO_NANO) & TICKS_MAX
+
+
+def ticks_us():
+    return (_time_source() // _MICRO_TO_NANO) & TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    """The signed difference ticks1 - ticks2 allowing for wraparound."""
+    return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def _sleepNs(num_ns):
+    if num_ns <= 0:
+        return
+    if _clock is not None:
+        _clock.advance(num_ns)
+        microbit.scheduler.run()
+    else:
+        microbit.scheduler.sleepUntil(time.monotonic_ns() + num_ns)
+
+
+def sleep(seconds):
+    _sleepNs(round(seconds * _SEC_TO_NANO))
+
+
+def sleep_ms(num_ms):
+    _sleepNs(num_ms * _MILLI_TO_NANO)
+
+
+def sleep_us(num_us):
+    _sleepNs(num_us * _MICRO_TO_NANO)
+
+
+def sleep_until(deadline):
+    """Sleep until ticks_ms() reaches deadline, for fixed rate loops use
+       deadline = ticks_add(deadline, period) each time so that the
+       time spent in the loop does not accumulate.
+       Returns how many milliseconds late the deadline already was.
+       """
+    remaining = ticks_diff(deadline, ticks_ms())
+    _sleepNs(remaining * _MILLI_TO_NANO)
+    return max(0, -remaining)
+
+
+def sleep_until_us(deadline):
+    """As sleep_until() for a deadline from ticks_us()."""
+    remaining = ticks_diff(deadline, ticks_us())
+    _sleepNs(remaining * _MICRO_TO_NANO)
+    return max(0, -remaining)